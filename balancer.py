@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""HDFS Balancer: move blocks from over-utilized datanodes to under-utilized ones
+Attributes:
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+import simpy
+from simpy.events import AllOf
+
+import node
+
+
+class Throttler(object):
+    """Limit the bytes a datanode moves per second, as DataTransferThrottler does"""
+
+    def __init__(self, env, bandwidth, period=0.5):
+        self.env = env
+        self.period = period
+        self.period_extension = 3 * period
+        self.bytes_per_period = bandwidth * period
+        self.period_start = env.now
+        self.reserve = self.bytes_per_period
+
+    def throttle(self, num_bytes):
+        """Wait until num_bytes could be sent: use it with `yield from`"""
+        self.reserve -= num_bytes
+        while self.reserve <= 0:
+            period_end = self.period_start + self.period
+            if self.env.now < period_end:
+                yield self.env.timeout(period_end - self.env.now)
+            elif self.env.now < self.period_start + self.period_extension:
+                self.period_start = period_end
+                self.reserve += self.bytes_per_period
+            else:
+                # the throttler has been idle for a long time, discard previous periods
+                self.period_start = self.env.now
+                self.reserve = self.bytes_per_period - num_bytes
+
+
+class Balancer(node.BaseSim):
+    """Iteratively plan and dispatch block moves until every datanode utilization is within threshold
+
+    Each iteration classifies datanodes into over-utilized, above-average, below-average and
+    under-utilized groups, matches sources with targets (same rack first), then dispatches the moves
+    concurrently. Each datanode runs at most max_concurrent_moves moves and moves at most
+    hdfs.balance_bandwidth bytes per second.
+    """
+
+    def __init__(self, hdfs, threshold=10.0, max_concurrent_moves=5, max_size_to_move=10*1024*1024*1024,
+                 max_iterations=20, max_idle_iterations=5, **kwargs):
+        super(Balancer, self).__init__(**kwargs)
+
+        self.env = hdfs.env
+        self.id = "balancer"
+        self.hdfs = hdfs
+        self.namenode = hdfs.namenode
+        #: percentage of disk capacity a datanode utilization could differ from the cluster average
+        self.threshold = threshold
+        #: dfs.datanode.balance.max.concurrent.moves
+        self.max_concurrent_moves = max_concurrent_moves
+        #: at most this many bytes are scheduled from/to one datanode per iteration
+        self.max_size_to_move = max_size_to_move
+        self.max_iterations = max_iterations
+        #: give up if no block could be moved for this many iterations
+        self.max_idle_iterations = max_idle_iterations
+
+        self.throttlers = {}
+        self.movers = {}
+        self.moved_blocks = 0
+        self.moved_bytes = 0
+        self.iterations = 0
+
+    def start(self):
+        return self.env.process(self._run())
+
+    def get_average_utilization(self):
+        used = sum([self.namenode.get_datanode_used(node_id) for node_id in self.namenode.datanodes])
+        capacity = sum([datanode.disk for datanode in self.namenode.datanodes.values()])
+        return 100.0 * used / capacity
+
+    def classify_datanodes(self):
+        """Return over-utilized, above-average, below-average, under-utilized datanodes and their budgets"""
+        average = self.get_average_utilization()
+        over, above, below, under = [], [], [], []
+        size_to_move = {}
+        for node_id, datanode in sorted(self.namenode.datanodes.items()):
+            utilization = self.namenode.get_datanode_utilization(node_id)
+            size_to_move[node_id] = min(self.max_size_to_move, int(abs(utilization - average) * datanode.disk / 100))
+            if utilization > average + self.threshold:
+                over.append(node_id)
+            elif utilization > average:
+                above.append(node_id)
+            elif utilization < average - self.threshold:
+                under.append(node_id)
+            else:
+                below.append(node_id)
+            self.debug("UTILIZATION\t%s\t%.4f%%\taverage: %.4f%%" % (node_id, utilization, average))
+        return over, above, below, under, size_to_move
+
+    def plan_moves(self):
+        """Match sources with targets: over->under, over->below, above->under; same rack first"""
+        over, above, below, under, size_to_move = self.classify_datanodes()
+        moves = []
+        scheduled = set()
+        for same_rack in (True, False):
+            for source_group, target_group in ((over, under), (over, below), (above, under)):
+                for source in source_group:
+                    for target in target_group:
+                        if same_rack and self.namenode.datanodes[source].rack != self.namenode.datanodes[target].rack:
+                            continue
+                        moves.extend(self._match(source, target, size_to_move, scheduled))
+        return moves, bool(over or under)
+
+    def _match(self, source, target, size_to_move, scheduled):
+        moves = []
+        for block in sorted(self.namenode.get_datanode_blocks(source)):
+            size = self.namenode.get_replica_size(block, source)
+            if block in scheduled or target in self.namenode.metadata[block] or size <= 0:
+                continue
+            if size > size_to_move[source] or size > size_to_move[target]:
+                continue
+            size_to_move[source] -= size
+            size_to_move[target] -= size
+            scheduled.add(block)
+            moves.append((block, source, target, size))
+        return moves
+
+    def get_throttler(self, node_id):
+        if node_id not in self.throttlers:
+            self.throttlers[node_id] = Throttler(self.env, self.hdfs.balance_bandwidth)
+        return self.throttlers[node_id]
+
+    def get_movers(self, node_id):
+        if node_id not in self.movers:
+            self.movers[node_id] = simpy.Resource(self.env, capacity=self.max_concurrent_moves)
+        return self.movers[node_id]
+
+    def _move(self, block, source, target, size):
+        # sources and targets never overlap in one iteration, so this order could not deadlock
+        with self.get_movers(source).request() as source_mover:
+            yield source_mover
+            with self.get_movers(target).request() as target_mover:
+                yield target_mover
+                self.info("MOVE_START\t%s\t%s->%s\t%4.2f MB" % (block, source, target, float(size)/1024/1024))
+                start_time = self.env.now
+                moved_bytes = 0
+                while moved_bytes < size:
+                    sending_size = min(self.hdfs.client_write_packet_size, size - moved_bytes)
+                    yield from self.get_throttler(source).throttle(sending_size)
+                    yield from self.get_throttler(target).throttle(sending_size)
+                    yield self.hdfs.datanodes[source].new_disk_read_request(sending_size, block)
+                    yield self.hdfs.transfer_data(source, target, sending_size, stream=block)
+                    moved_bytes += sending_size
+        datanode_names = self.namenode.metadata.get(block, [])
+        if source not in datanode_names or target in datanode_names:
+            # the block was rewritten while it was moving
+            self.warning("%s changed during the move %s->%s, drop the moved replica" % (block, source, target))
+            return
+        self.namenode.move_replica(block, source, target)
+        self.hdfs.datanodes[target].receive_block(block, size)
+        self.hdfs.datanodes[source].delete_block(block)
+        self.moved_blocks += 1
+        self.moved_bytes += size
+        self.info("MOVE_DONE\t%s\t%s->%s\t%4.2fs" % (block, source, target, self.env.now - start_time))
+
+    def _run(self):
+        start_time = self.env.now
+        idle_iterations = 0
+        while self.iterations < self.max_iterations and idle_iterations < self.max_idle_iterations:
+            moves, is_unbalanced = self.plan_moves()
+            if not is_unbalanced:
+                break
+            if not moves:
+                idle_iterations += 1
+                self.warning("no block could be moved in iteration %i" % self.iterations)
+                # wait for foreground writes to change the namespace
+                yield self.env.timeout(self.hdfs.heartbeat_interval)
+            else:
+                idle_iterations = 0
+                self.info("ITERATION %i\t%i moves scheduled" % (self.iterations, len(moves)))
+                yield AllOf(self.env, [self.env.process(self._move(*m)) for m in moves])
+            self.iterations += 1
+        self.critical("BALANCER_DONE\t%i blocks, %4.2f MB moved in %4.2fs"
+                      % (self.moved_blocks, float(self.moved_bytes)/1024/1024, self.env.now - start_time))
+        return self.env.now - start_time
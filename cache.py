@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Content-addressed cache of simulation results
+Attributes:
+    SOURCE_DIR: the simulator sources which version the cached results
+    MISS: the default ResultCache.run looks results up with, as a cached result may be None
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import hdfs
+
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+MISS = object()
+
+
+def get_source_version(source_dir=SOURCE_DIR):
+    """Hash every simulator module, tests excluded"""
+    sha = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(source_dir, "*.py"))):
+        if path.endswith("_test.py"):
+            continue
+        sha.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def get_key(config, operation, args, seed, source_version):
+    content = json.dumps({
+        "config": config,
+        "operation": operation,
+        "args": list(args),
+        "seed": seed,
+        "source_version": source_version,
+    }, sort_keys=True, default=repr)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ResultCache(object):
+    """Results of create_hdfs(**config).operation(*args), stored in SQLite with LRU eviction"""
+
+    def __init__(self, path="results.sqlite", max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.source_version = get_source_version()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results "
+                        "(key TEXT PRIMARY KEY, value TEXT, created REAL, accessed INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key, default=None):
+        """Return the cached result, or default on a miss: a cached result may be None itself"""
+        row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        self.db.execute("UPDATE results SET accessed = ? WHERE key = ?", (self.next_access(), key))
+        self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(value), time.time(), self.next_access()))
+        self.evict()
+        self.db.commit()
+
+    def next_access(self):
+        """A logical clock, wall time is too coarse to order accesses"""
+        return self.db.execute("SELECT COALESCE(MAX(accessed), 0) + 1 FROM results").fetchone()[0]
+
+    def evict(self):
+        """Drop the least recently used results beyond max_entries"""
+        self.db.execute("DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def run(self, operation, args=(), seed=0, **config):
+        """Return the cached result, or simulate a silent HDFS and cache its result"""
+        key = get_key(config, operation, args, seed, self.source_version)
+        result = self.get(key, MISS)
+        if result is not MISS:
+            self.hits += 1
+            return result
+        self.misses += 1
+        the_hdfs = hdfs.create_silent_hdfs(seed=seed, **config)
+        result = getattr(the_hdfs, operation)(*args)
+        self.put(key, result)
+        return result
+
+    def sweep(self, axis, values, operation, args=(), seed=0, **config):
+        """Run operation for every value of one create_hdfs argument, only simulating uncached points"""
+        results = []
+        for value in values:
+            config[axis] = value
+            results.append((value, self.run(operation, args, seed, **config)))
+        return results
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Brief Summary
+Attributes:
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import cache
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = cache.ResultCache(os.path.join(self.tmpdir, "results.sqlite"), max_entries=2)
+        self.config = dict(number_of_datanodes=3, enable_heartbeats=False, enable_block_report=False)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_hit(self):
+        t = self.cache.run("put_files", (1, 1024*1024), seed=1, **self.config)
+        self.assertEqual(self.cache.run("put_files", (1, 1024*1024), seed=1, **self.config), t)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.cache.run("put_files", (1, 1024*1024), seed=2, **self.config)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_hit_none(self):
+        self.assertIsNone(self.cache.run("start_services", **self.config))
+        self.assertIsNone(self.cache.run("start_services", **self.config))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_sweep_and_eviction(self):
+        self.cache.sweep("replica_number", [1, 2], "put_files", (1, 1024*1024), **self.config)
+        self.cache.sweep("replica_number", [2, 3], "put_files", (1, 1024*1024), **self.config)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+        self.assertEqual(len(self.cache), 2)
+        # replica_number=1 was the least recently used
+        self.cache.run("put_files", (1, 1024*1024), replica_number=1, **self.config)
+        self.assertEqual(self.cache.misses, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,6 +43,56 @@ class TestDefault(unittest.TestCase):
         self.env.run(290)
 
 
+    def test_reads_share_disk_with_writes(self):
+        single = node.Node(self.env, "single", disk_speed=80*1024*1024, do_info=False, seed=1)
+        requests = [single.new_disk_read_request(80*1024*1024) for i in range(4)]
+        requests += [single.new_disk_write_request(80*1024*1024) for i in range(2)]
+        self.env.run(simpy.events.AllOf(self.env, requests))
+        # 480 MB through one 80 MB/s disk
+        self.assertGreaterEqual(self.env.now, 6)
+
+class TestVolume(unittest.TestCase):
+    def setUp(self):
+        self.env = simpy.Environment()
+
+    def write_streams(self, node, number_of_streams, size):
+        writes = [node.new_disk_write_request(size, stream="blk_%i" % i) for i in range(number_of_streams)]
+        self.env.run(simpy.events.AllOf(self.env, writes))
+        return self.env.now
+
+    def test_parallel_volumes(self):
+        jbod = node.Node(self.env, "jbod", disk_volumes=4, do_info=False)
+        t = self.write_streams(jbod, 4, 80*1024*1024)
+        self.assertLess(t, 2)
+        self.assertEqual(sorted([v.written_bytes for v in jbod.volumes]), [80*1024*1024] * 4)
+
+        single = node.Node(self.env, "single", disk_volumes=1, do_info=False)
+        start = self.env.now
+        self.assertGreater(self.write_streams(single, 4, 80*1024*1024) - start, 4)
+
+    def test_available_space_policy(self):
+        jbod = node.Node(self.env, "jbod", disk_volumes=2, disk=40*1024*1024*1024,
+                         volume_choosing_policy="available-space", do_info=False, seed=1)
+        jbod.volumes[0].reserve(15*1024*1024*1024)
+        self.write_streams(jbod, 10, 1024*1024)
+        self.assertGreater(jbod.volumes[1].written_bytes, jbod.volumes[0].written_bytes)
+
+    def test_volume_failure(self):
+        jbod = node.Node(self.env, "jbod", disk_volumes=3, failed_volumes_tolerated=2, do_info=False,
+                         do_critical=False)
+        self.write_streams(jbod, 3, 1024*1024)
+        lost = jbod.process_fail_volume(0)
+        self.env.run(lost)
+        self.assertEqual(lost.value, ["blk_0"])
+        self.assertTrue(jbod.disk_alive.triggered)
+        self.write_streams(jbod, 1, 1024*1024)
+        self.assertEqual(jbod.volumes[0].written_bytes, 1024*1024)
+
+        self.env.run(jbod.process_fail_volume(1))
+        self.env.run(jbod.process_fail_volume(2))
+        self.assertFalse(jbod.disk_alive.triggered)
+
+
 class TestSwitch(unittest.TestCase):
     def setUp(self):
         env = simpy.Environment()
@@ -58,6 +108,27 @@ class TestSwitch(unittest.TestCase):
 
         self.env.run(300)
 
+    def test_full_duplex(self):
+        node3 = node.Node(self.env, 3)
+        for n in (self.node, self.node2, node3):
+            self.switch.add_node(n)
+        size = 10 * self.node.bandwidth
+        # node2 receives from node1 while it sends to node3 and back to node1
+        pings = [self.switch.process_ping(1, 2, size), self.switch.process_ping(2, 3, size),
+                 self.switch.process_ping(2, 1, size)]
+        self.env.run(simpy.events.AllOf(self.env, pings))
+        self.assertLess(self.env.now, 21)
+
+    def test_asymmetric_bandwidth(self):
+        slow_receiver = node.Node(self.env, 3, rx_bandwidth=self.node.bandwidth / 2)
+        for n in (self.node, slow_receiver):
+            self.switch.add_node(n)
+        self.env.run(self.switch.process_ping(1, 3, 10 * self.node.bandwidth))
+        self.assertGreater(self.env.now, 20)
+        start = self.env.now
+        self.env.run(self.switch.process_ping(3, 1, 10 * self.node.bandwidth))
+        self.assertLess(self.env.now - start, 11)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compact binary event log of a simulation, and its offline analyzer
+Attributes:
+    RECORD_FORMAT: one fixed-width little-endian record: time, event type, src, dst, bytes, duration
+    EVENT_NAMES: event type -> name
+
+Every record is written when its event completes, so it covers [time - duration, time]. Node names
+are interned as integers, the name table is stored next to the log in "<path>.ids".
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+import json
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:  # numpy is only needed to analyze a log
+    numpy = None
+
+
+TRANSFER = 1
+DISK_WRITE = 2
+DISK_READ = 3
+BUFFER_WRITE = 4
+DISK_FLUSH = 5
+FAILURE = 6
+
+EVENT_NAMES = {
+    TRANSFER: "TRANSFER",
+    DISK_WRITE: "DISK_WRITE",
+    DISK_READ: "DISK_READ",
+    BUFFER_WRITE: "BUFFER_WRITE",
+    DISK_FLUSH: "DISK_FLUSH",
+    FAILURE: "FAILURE",
+}
+
+#: events which keep a disk busy
+DISK_EVENTS = (DISK_WRITE, DISK_READ, DISK_FLUSH)
+
+RECORD_FORMAT = "<dIIIqd"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+
+def get_ids_path(path):
+    return path + ".ids"
+
+
+class EventRecorder(object):
+    """Append fixed-width records to a binary file"""
+
+    def __init__(self, path, buffer_size=1024*1024):
+        self.path = path
+        self.names = []
+        if os.path.exists(get_ids_path(path)):
+            with open(get_ids_path(path)) as f:
+                self.names = json.load(f)
+        self.ids = dict([(name, i) for i, name in enumerate(self.names)])
+        self.file = open(path, "ab", buffer_size)
+        self.record_struct = struct.Struct(RECORD_FORMAT)
+
+    def get_id(self, name):
+        name = str(name)
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def record(self, time, event_type, src, dst, size, duration):
+        self.file.write(self.record_struct.pack(time, event_type, self.get_id(src), self.get_id(dst),
+                                                int(size), duration))
+
+    def flush(self):
+        self.file.flush()
+        with open(get_ids_path(self.path), "w") as f:
+            json.dump(self.names, f)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class EventLog(object):
+    """Memory-map a log written by EventRecorder and analyze it with vectorized NumPy"""
+
+    def __init__(self, path):
+        if numpy is None:
+            raise ImportError("numpy is required to analyze an event log")
+        self.dtype = numpy.dtype([("time", "<f8"), ("type", "<u4"), ("src", "<u4"), ("dst", "<u4"),
+                                  ("bytes", "<i8"), ("duration", "<f8")])
+        assert self.dtype.itemsize == RECORD_SIZE
+        if os.path.getsize(path) > 0:
+            self.records = numpy.memmap(path, dtype=self.dtype, mode="r")
+        else:
+            self.records = numpy.zeros(0, dtype=self.dtype)
+        with open(get_ids_path(path)) as f:
+            self.names = json.load(f)
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, *event_types):
+        return self.records[numpy.isin(self.records["type"], event_types)]
+
+    def get_span(self):
+        """Return (start, end) of the simulated time covered by the log"""
+        if not len(self.records):
+            return 0.0, 0.0
+        return float((self.records["time"] - self.records["duration"]).min()), float(self.records["time"].max())
+
+    def get_event_counts(self):
+        types, counts = numpy.unique(self.records["type"], return_counts=True)
+        return dict([(EVENT_NAMES[int(t)], int(c)) for t, c in zip(types, counts)])
+
+    def get_link_utilization(self):
+        """Return {(src, dst): fraction of the log span spent transferring from src to dst}"""
+        transfers = self.select(TRANSFER)
+        start, end = self.get_span()
+        if not len(transfers) or end <= start:
+            return {}
+        links = transfers["src"].astype("<u8") << 32 | transfers["dst"]
+        unique_links, inverse = numpy.unique(links, return_inverse=True)
+        busy = numpy.bincount(inverse, weights=transfers["duration"])
+        return dict([((self.names[int(link >> 32)], self.names[int(link & 0xffffffff)]), float(b) / (end - start))
+                     for link, b in zip(unique_links, busy)])
+
+    def get_disk_busy_time(self):
+        """Return {node or volume: seconds its disk spent writing, reading or flushing}
+
+        Concurrent IOs share a disk, so its busy time is the length of the union of their intervals.
+        """
+        disk_events = self.select(*DISK_EVENTS)
+        if not len(disk_events):
+            return {}
+        ends = disk_events["time"]
+        starts = ends - disk_events["duration"]
+        # shift every disk into its own time range, so that one sweep merges the intervals of all disks
+        offsets = disk_events["src"] * (float(ends.max() - starts.min()) + 1)
+        starts = starts + offsets
+        ends = ends + offsets
+        order = numpy.lexsort((starts, disk_events["src"]))
+        starts, ends, disks = starts[order], ends[order], disk_events["src"][order]
+        covered_until = numpy.concatenate(([-numpy.inf], numpy.maximum.accumulate(ends)[:-1]))
+        uncovered = numpy.clip(ends - numpy.maximum(starts, covered_until), 0, None)
+        busy = numpy.bincount(disks, weights=uncovered)
+        return dict([(self.names[i], float(b)) for i, b in enumerate(busy) if b > 0])
+
+    def get_transfer_size_histogram(self, bins=None):
+        """Return (counts, bin edges) of transfer sizes, with power-of-two bins by default"""
+        sizes = self.select(TRANSFER)["bytes"]
+        if bins is None:
+            largest = max(1, int(sizes.max())) if len(sizes) else 1
+            bins = 2 ** numpy.arange(0, int(numpy.ceil(numpy.log2(largest))) + 2)
+        return numpy.histogram(sizes, bins=bins)
+
+
+def main():
+    """Main function only in command line"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Analyze a binary event log.')
+    parser.add_argument('path', help='event log written by hdfs.py --event-log')
+    args = parser.parse_args()
+
+    log = EventLog(args.path)
+    start, end = log.get_span()
+    print("%i events in [%.3f, %.3f]s: %s" % (len(log), start, end, log.get_event_counts()))
+    print("Link\tUtilization")
+    for link, utilization in sorted(log.get_link_utilization().items(), key=lambda x: -x[1]):
+        print("%s->%s\t%.4f" % (link[0], link[1], utilization))
+    print("Disk\tBusyTime")
+    for disk, busy_time in sorted(log.get_disk_busy_time().items()):
+        print("%s\t%.3f" % (disk, busy_time))
+    print("TransferSize\tCount")
+    counts, edges = log.get_transfer_size_histogram()
+    for count, edge in zip(counts, edges):
+        if count:
+            print(">=%i\t%i" % (edge, count))
+
+
+if __name__ == '__main__':
+    main()
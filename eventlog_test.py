@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Brief Summary
+Attributes:
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import simpy
+
+import eventlog
+import hdfs
+import node
+
+
+@unittest.skipIf(eventlog.numpy is None, "numpy is not installed")
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "events.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_record_and_analyze(self):
+        recorder = eventlog.EventRecorder(self.path)
+        the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=4, enable_heartbeats=False, enable_block_report=False,
+                                           enable_datanode_cache=False, recorder=recorder)
+        the_hdfs.put_files(2, 4*1024*1024)
+        the_hdfs.datanodes["datanode0"].process_break_disk()
+        the_hdfs.run_until(the_hdfs.env.now + 1)
+        recorder.close()
+        self.assertEqual(os.path.getsize(self.path) % eventlog.RECORD_SIZE, 0)
+
+        log = eventlog.EventLog(self.path)
+        counts = log.get_event_counts()
+        self.assertEqual(counts["FAILURE"], 1)
+        self.assertEqual(counts["DISK_WRITE"], 2 * 4 * 3)
+        self.assertEqual(int(log.select(eventlog.TRANSFER)["bytes"].sum()), the_hdfs.switch.transferred_bytes)
+
+        utilization = log.get_link_utilization()
+        client_links = [link for link in utilization if link[0] == "client"]
+        self.assertTrue(client_links)
+        for u in utilization.values():
+            self.assertTrue(0 < u <= 1)
+        self.assertEqual(set(log.get_disk_busy_time()),
+                         set([n for n in the_hdfs.datanodes if the_hdfs.datanodes[n].disk_written_bytes]))
+        counts, edges = log.get_transfer_size_histogram()
+        self.assertEqual(counts.sum(), len(log.select(eventlog.TRANSFER)))
+
+    def test_concurrent_disk_writes(self):
+        recorder = eventlog.EventRecorder(self.path)
+        env = simpy.Environment()
+        n = node.Node(env, "n", do_info=False, recorder=recorder, seed=1)
+        env.run(simpy.events.AllOf(env, [n.new_disk_write_request(80*1024*1024) for i in range(8)]))
+        recorder.close()
+
+        log = eventlog.EventLog(self.path)
+        start, end = log.get_span()
+        busy_time = log.get_disk_busy_time()["n"]
+        self.assertLessEqual(busy_time, end - start + 1e-9)
+        self.assertGreaterEqual(busy_time, 8.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
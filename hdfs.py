@@ -9,29 +9,36 @@ Google Python Style Guide:
 __copyright__ = "Zhaoyu Luo"
 
 import argparse
-import random
+import math
 
 import simpy
 from simpy.events import AllOf
 
+import balancer
+import eventlog
+import mapreduce
 import node
+import pipeline
 
 
-class HDFS(node.BaseSim):
+class HDFS(pipeline.WritePipeline):
     """By default, HDFS owns one switch and one client machine, it would instantiate that automatically
     The client machine would only be used to submit its task
     """
 
     def __init__(self, env, namenode, replica_number=3, heartbeat_interval=3, heartbeat_size=1024,
                  enable_datanode_cache=True, enable_heartbeats=True, enable_block_report=True,
-                 block_report_interval=30, balance_bandwidth=1024*1024, client_write_packet_size=1024*1024,
-                 **kwargs):
-        super(HDFS, self).__init__(**kwargs)
+                 block_report_interval=None, enable_incremental_block_report=True, incremental_block_report_interval=0,
+                 balance_bandwidth=1024*1024, client_write_packet_size=1024*1024,
+                 max_bytes_in_flight=80*64*1024, max_packets_in_flight=None, ack_size=64, erasure_coding_policy=None,
+                 ec_cell_size=1024*1024, ec_codec_speed=1024*1024*1024, **kwargs):
+        super(HDFS, self).__init__(client_write_packet_size=client_write_packet_size,
+                                   max_bytes_in_flight=max_bytes_in_flight, max_packets_in_flight=max_packets_in_flight,
+                                   ack_size=ack_size, **kwargs)
 
         self.env = env
         self.id = "HDFS"
 
-        self.client_write_packet_size = client_write_packet_size
         self.block_size = 64 * 1024 * 1024
         self.replica_number = replica_number
         self.enable_datanode_cache = enable_datanode_cache
@@ -39,15 +46,31 @@ class HDFS(node.BaseSim):
         self.enable_block_report = enable_block_report
         self.heartbeat_size = heartbeat_size
         self.heartbeat_interval = heartbeat_interval
+        #: send block changes as they happen and size full reports by the stored blocks
+        self.enable_incremental_block_report = enable_incremental_block_report
+        #: dfs.blockreport.intervalMsec, in seconds: full reports are rare once changes are reported incrementally
+        if block_report_interval is None:
+            block_report_interval = 6 * 3600 if enable_incremental_block_report else 30
         self.block_report_interval = block_report_interval
+        #: dfs.blockreport.incremental.intervalMsec, in seconds
+        self.incremental_block_report_interval = incremental_block_report_interval
         #: dfs.datanode.balance.bandwidthPerSec
         self.balance_bandwidth = balance_bandwidth
+        #: one of node.ERASURE_CODING_POLICIES, or None to replicate files replica_number times
+        if erasure_coding_policy and erasure_coding_policy not in node.ERASURE_CODING_POLICIES:
+            raise node.SimulatorException("unknown erasure coding policy: %s" % erasure_coding_policy)
+        self.erasure_coding_policy = erasure_coding_policy
+        self.ec_cell_size = ec_cell_size
+        #: bytes per second the client encodes, or a datanode decodes
+        self.ec_codec_speed = ec_codec_speed
 
         self.switch = node.Switch(env, **kwargs)
         self.client = node.Node(env, "client", **kwargs)
         self.switch.add_node(self.client)
 
         self.datanodes = {}
+        #: MapReduce jobs run by run_job
+        self.jobs = []
         if namenode:
             self.set_namenode(namenode)
 
@@ -72,6 +95,8 @@ class HDFS(node.BaseSim):
 
         for node_name in self.datanodes:
             self.datanodes[node_name].start_block_report(self.block_report_interval)
+            if self.enable_incremental_block_report:
+                self.datanodes[node_name].start_incremental_block_report(self.incremental_block_report_interval)
         self.critical("start HDFS block report")
 
     def start_hdfs_heartbeat(self):
@@ -80,7 +105,7 @@ class HDFS(node.BaseSim):
             return
 
         for node_name in self.datanodes:
-            self.switch.start_heartbeat(node_name, self.namenode.id, self.heartbeat_size, self.heartbeat_interval)
+            self.datanodes[node_name].start_heartbeat(self.heartbeat_interval, self.heartbeat_size)
         self.critical("start HDFS heartbeat")
 
     def set_namenode(self, node):
@@ -91,77 +116,224 @@ class HDFS(node.BaseSim):
     def create_datanode(self, node_id, **kwargs):
         datanode = node.DataNode(self.env, node_id, hdfs=self,
                                  do_debug=self.do_debug, do_info=self.do_info, do_warning=self.do_warning, do_critical=self.do_critical,
-                                 **kwargs)
+                                 recorder=self.recorder, seed=self.seed, **kwargs)
         self.add_datanode(datanode)
 
     def add_datanode(self, node):
         self.datanodes[node.id] = node
         self.switch.add_node(node)
 
-    def transfer_data(self, from_node_id, to_node_id, size, throttle_bandwidth=-1):
-        return self.env.process(self._transfer_data(from_node_id, to_node_id, size, throttle_bandwidth))
-
-    def _transfer_data(self, from_node_id, to_node_id, size, throttle_bandwidth=-1):
-        yield self.switch.process_ping(from_node_id, to_node_id, size, throttle_bandwidth)
+    def store_data(self, node_id, size, stream=None):
+        """Write data of a stream (block) on a datanode, through its disk buffer if datanode cache is enabled"""
         if self.enable_datanode_cache:
-            yield self.datanodes[to_node_id].new_disk_buffer_write_request(size)
-        else:
-            yield self.datanodes[to_node_id].new_disk_write_request(size)
+            return self.datanodes[node_id].new_disk_buffer_write_request(size, stream=stream)
+        return self.datanodes[node_id].new_disk_write_request(size, stream=stream)
 
-    def replicate_file(self, file_name, size, node_sequence, throttle_bandwidth=-1):
-        return self.env.process(self._replicate_file(file_name, size, node_sequence, throttle_bandwidth))
+    def transfer_data(self, from_node_id, to_node_id, size, throttle_bandwidth=-1, stream=None):
+        return self.env.process(self._transfer_data(from_node_id, to_node_id, size, throttle_bandwidth, stream))
 
-    def _replicate_file(self, file_name, size, node_sequence, throttle_bandwidth=-1):
-        self.info("REPLICATING\t%s\tin %s" % (file_name, node_sequence))
-        i = 0
-        while i < len(node_sequence) - 1:
-            yield self.transfer_data(node_sequence[i], node_sequence[i+1], size, throttle_bandwidth)
-            i += 1
-        self.info("REPLICATED\t%s\tin %s" % (file_name, node_sequence))
+    def _transfer_data(self, from_node_id, to_node_id, size, throttle_bandwidth=-1, stream=None):
+        yield self.switch.process_ping(from_node_id, to_node_id, size, throttle_bandwidth)
+        yield self.store_data(to_node_id, size, stream)
+
+    def get_number_of_blocks(self, size, data_units=1):
+        """A block (group) holds block_size bytes on each of its data_units datanodes"""
+        return max(1, int(math.ceil(float(size) / (self.block_size * data_units))))
 
     def create_file(self, file_name, size, node_sequence, throttle_bandwidth=-1):
         return self.env.process(self._create_file(file_name, size, node_sequence, throttle_bandwidth))
 
     def _create_file(self, file_name, size, node_sequence, throttle_bandwidth=-1):
-        """big file would be splitted into packtes <= 64KB"""
-        # pipeline writing (divide into packets) to all datanodes
-        sent_file_size = 0
-        pipeline_events = []
-        i = 1
-        while sent_file_size < size:
-            sending_size = min(self.client_write_packet_size, size - sent_file_size)
-            p = self.replicate_file("%s.%i" % (file_name, i), sending_size, node_sequence, throttle_bandwidth)
-            pipeline_events.append(p)
-            sent_file_size += sending_size
-            i += 1
-
-        # wait for all ACKs
-        yield AllOf(self.env, pipeline_events)
+        """Stream a file through the pipeline of node_sequence packet by packet, see pipeline.WritePipeline"""
+        for i in range(self.get_number_of_blocks(size)):
+            yield self.namenode.process_rpc("add_block")
+        yield self.write_packets(file_name, size, node_sequence, throttle_bandwidth)
         if self.client.id in node_sequence:
             node_sequence.remove(self.client.id)
-        self.namenode.register_file(file_name, node_sequence)
+        for datanode_name in node_sequence:
+            self.datanodes[datanode_name].receive_block(file_name, size)
+        yield self.namenode.process_rpc("complete")
+        self.namenode.register_file(file_name, node_sequence, size)
         self.critical("ALL ACKs collected, put_file %s finished" % (file_name))
 
+    def transmit(self, from_node_id, to_node_id, size, packet, is_ack=False):
+        return self.env.process(self._transmit(from_node_id, to_node_id, size, packet, is_ack))
+
+    def _transmit(self, from_node_id, to_node_id, size, packet, is_ack=False):
+        """Packets and acks cross the Switch store-and-forward, a packet then waits for room downstream"""
+        if is_ack:
+            yield self.switch.process_ping(from_node_id, to_node_id, size)
+            self.receive_ack(packet)
+        else:
+            yield self.switch.process_ping(from_node_id, to_node_id, size, packet["throttle_bandwidth"])
+            yield self.receive_packet(packet)
+
+    def create_striped_file(self, file_name, size, datanode_names):
+        return self.env.process(self._create_striped_file(file_name, size, datanode_names))
+
+    def _create_striped_file(self, file_name, size, datanode_names):
+        """Encode the file stripe by stripe on the client and send the cells of every stripe in parallel
+
+        The first data_units datanodes receive data cells, the others receive parity cells. At most
+        max_packets_in_flight cells are unacknowledged.
+        """
+        data_units, parity_units = node.ERASURE_CODING_POLICIES[self.erasure_coding_policy]
+        for i in range(self.get_number_of_blocks(size, data_units)):
+            yield self.namenode.process_rpc("add_block")
+        window = simpy.Container(self.env, init=self.max_packets_in_flight, capacity=self.max_packets_in_flight)
+        cell_events = []
+        # data unit i stores its own cells, parity units as many bytes as data unit 0
+        internal_block_sizes = dict([(n, 0) for n in datanode_names])
+        sent_file_size = 0
+        while sent_file_size < size:
+            stripe_size = min(data_units * self.ec_cell_size, size - sent_file_size)
+            data_cells = []
+            for i in range(data_units):
+                data_cells.append(max(0, min(self.ec_cell_size, stripe_size - i * self.ec_cell_size)))
+            # parity cells are as large as the largest data cell
+            cells = data_cells + [data_cells[0]] * parity_units
+            yield self.env.timeout(float(stripe_size) / self.ec_codec_speed)
+            for datanode_name, cell_size in zip(datanode_names, cells):
+                if cell_size <= 0:
+                    continue
+                internal_block_sizes[datanode_name] += cell_size
+                yield window.get(1)
+                cell_events.append(self.env.process(self._send_cell(file_name, datanode_name, cell_size, window)))
+            sent_file_size += stripe_size
+
+        yield AllOf(self.env, cell_events)
+        # the datanodes of data units past the end of a partial stripe receive no cell
+        internal_block_sizes = dict([(n, s) for n, s in internal_block_sizes.items() if s > 0])
+        for datanode_name in datanode_names:
+            if datanode_name in internal_block_sizes:
+                self.datanodes[datanode_name].receive_block(file_name, internal_block_sizes[datanode_name])
+        yield self.namenode.process_rpc("complete")
+        self.namenode.register_file(file_name, datanode_names, size, self.erasure_coding_policy, internal_block_sizes)
+        self.critical("ALL cells acked, put striped file %s finished" % (file_name))
+
+    def _send_cell(self, file_name, datanode_name, cell_size, window):
+        yield self.transfer_data(self.client.id, datanode_name, cell_size, stream=file_name)
+        yield self.switch.process_ping(datanode_name, self.client.id, self.ack_size)
+        yield window.put(1)
+
     def put_files(self, num, size, throttle_bandwidth=-1):
         """This API is used by client"""
         events = []
         for i in range(num):
             file_name = "hello.%i.txt" % i
-            datanode_names = self.namenode.find_datanodes_for_new_file(file_name, size, self.replica_number)
-            datanode_names.insert(0, self.client.id)
-            e = self.create_file(file_name, size, datanode_names, throttle_bandwidth)
+            if self.erasure_coding_policy:
+                group_size = sum(node.ERASURE_CODING_POLICIES[self.erasure_coding_policy])
+                if group_size > len(self.datanodes):
+                    raise node.SimulatorException("%s needs %i datanodes, only %i exist"
+                                                  % (self.erasure_coding_policy, group_size, len(self.datanodes)))
+                datanode_names = self.namenode.find_datanodes_for_new_file(file_name, size, group_size)
+                e = self.create_striped_file(file_name, size, datanode_names)
+            else:
+                datanode_names = self.namenode.find_datanodes_for_new_file(file_name, size, self.replica_number)
+                datanode_names.insert(0, self.client.id)
+                e = self.create_file(file_name, size, datanode_names, throttle_bandwidth)
             events.append(e)
         run_all = AllOf(self.env, events)
         self.run_until(run_all)
         self.critical("%i files stored in NameNode" % len(self.namenode.metadata))
         return self.env.now
 
+    def stream_data(self, from_node_id, to_node_id, size, throttle_bandwidth=-1, stream=None):
+        return self.env.process(self._stream_data(from_node_id, to_node_id, size, throttle_bandwidth, stream))
+
+    def _stream_data(self, from_node_id, to_node_id, size, throttle_bandwidth=-1, stream=None):
+        """Read size bytes of a stream on from_node_id and send them packet by packet without storing them"""
+        sent_size = 0
+        while sent_size < size:
+            sending_size = min(self.client_write_packet_size, size - sent_size)
+            yield self.datanodes[from_node_id].new_disk_read_request(sending_size, stream)
+            yield self.switch.process_ping(from_node_id, to_node_id, sending_size, throttle_bandwidth)
+            sent_size += sending_size
+
+    def reconstruct_blocks(self, failed_node_id, throttle_bandwidth=-1, file_names=None):
+        return self.env.process(self._reconstruct_blocks(failed_node_id, throttle_bandwidth, file_names))
+
+    def _reconstruct_blocks(self, failed_node_id, throttle_bandwidth=-1, file_names=None):
+        """Reconstruct the given blocks lost on failed_node_id, or all its blocks"""
+        if file_names is None:
+            file_names = self.namenode.get_datanode_blocks(failed_node_id)
+        events = []
+        for file_name in sorted(file_names):
+            events.append(self.env.process(self._reconstruct_block(file_name, failed_node_id, throttle_bandwidth)))
+        yield AllOf(self.env, events)
+
+    def _reconstruct_block(self, file_name, failed_node_id, throttle_bandwidth=-1):
+        """Copy a lost replica from a surviving one, or decode a lost internal block from data_units survivors"""
+        datanode_names = self.namenode.metadata[file_name]
+        survivors = [n for n in datanode_names if n != failed_node_id and self.datanodes[n].disk_alive.triggered]
+        candidates = [n for n in sorted(self.datanodes)
+                      if n not in datanode_names and self.datanodes[n].disk_alive.triggered]
+        block_size = self.namenode.get_replica_size(file_name, failed_node_id)
+        policy = self.namenode.erasure_coding.get(file_name)
+        needed = node.ERASURE_CODING_POLICIES[policy][0] if policy else 1
+        if len(survivors) < needed or not candidates:
+            self.critical("LOST\t%s\t%i survivors, %i candidates" % (file_name, len(survivors), len(candidates)))
+            return
+        target = self.random_stream.choice(candidates)
+        self.info("RECONSTRUCTING\t%s\t%s->%s" % (file_name, survivors[:needed], target))
+        if policy:
+            # decoding reads the first block_size bytes of every survivor, empty internal blocks are zeros
+            sizes = [(s, min(block_size, self.namenode.get_replica_size(file_name, s))) for s in survivors[:needed]]
+            yield AllOf(self.env, [self.stream_data(s, target, size, throttle_bandwidth, file_name)
+                                   for s, size in sizes if size > 0])
+            yield self.env.timeout(float(needed * block_size) / self.ec_codec_speed)
+            yield self.store_data(target, block_size, file_name)
+        else:
+            sent_size = 0
+            while sent_size < block_size:
+                sending_size = min(self.client_write_packet_size, block_size - sent_size)
+                yield self.datanodes[survivors[0]].new_disk_read_request(sending_size, file_name)
+                yield self.transfer_data(survivors[0], target, sending_size, throttle_bandwidth, file_name)
+                sent_size += sending_size
+        self.datanodes[target].receive_block(file_name, block_size)
+        self.namenode.move_replica(file_name, failed_node_id, target)
+        self.datanodes[failed_node_id].delete_block(file_name)
+
+    def run_reconstruction(self, failed_node_id, throttle_bandwidth=-1):
+        """Break the disk of a datanode, then return how long reconstructing its blocks takes"""
+        start_time = self.env.now
+        # the disk breaks before reconstruction chooses survivors, as both processes start now in order
+        self.datanodes[failed_node_id].process_break_disk()
+        self.run_until(self.reconstruct_blocks(failed_node_id, throttle_bandwidth))
+        return self.env.now - start_time
+
+    def run_volume_failure(self, node_id, volume_index, throttle_bandwidth=-1):
+        """Fail one volume of a datanode, then return how long reconstructing the blocks it held takes"""
+        start_time = self.env.now
+        lost_streams = self.datanodes[node_id].process_fail_volume(volume_index)
+        self.run_until(lost_streams)
+        lost_files = [f for f in lost_streams.value if node_id in self.namenode.metadata.get(f, [])]
+        for file_name in lost_streams.value:
+            self.datanodes[node_id].delete_block(file_name)
+        self.run_until(self.reconstruct_blocks(node_id, throttle_bandwidth, lost_files))
+        return self.env.now - start_time
+
+    def get_control_plane_stats(self):
+        """Bytes of full and incremental block reports, and NameNode RPC statistics"""
+        return {
+            "block_report_bytes": sum([d.block_report_bytes for d in self.datanodes.values()]),
+            "incremental_block_report_bytes": sum([d.incremental_block_report_bytes for d in self.datanodes.values()]),
+            "namenode_cpu_utilization": self.namenode.get_cpu_utilization(),
+            "rpc": self.namenode.rpc_stats,
+        }
+
+    def get_io_stats(self):
+        return {
+            "network_bytes": self.switch.transferred_bytes,
+            "disk_bytes": sum([d.disk_written_bytes for d in self.datanodes.values()]),
+        }
+
     def regenerate_blocks(self, num):
         """TODO: it is justly randomly regenerate blocks, not according to block placement and its replica number"""
         regenerate_events = []
         i = 1
         for i in range(num):
-            from_node_id, to_node_id = random.sample(self.namenode.datanodes.keys(), 2)
+            from_node_id, to_node_id = self.random_stream.sample(sorted(self.namenode.datanodes.keys()), 2)
             self.info("regenerating block %s->%s" % (from_node_id, to_node_id))
             r = self.create_file("block.%s.dat" % i, self.block_size, [from_node_id, to_node_id], self.balance_bandwidth)
             regenerate_events.append(r)
@@ -169,6 +341,29 @@ class HDFS(node.BaseSim):
         self.run_until(run_all)
         return self.env.now
 
+    def start_balancer(self, threshold=10.0, max_concurrent_moves=5, **kwargs):
+        """Start a Balancer process, it could run alongside other client operations"""
+        the_balancer = balancer.Balancer(self, threshold=threshold, max_concurrent_moves=max_concurrent_moves,
+                                         do_debug=self.do_debug, do_info=self.do_info, do_warning=self.do_warning,
+                                         do_critical=self.do_critical, seed=self.seed, **kwargs)
+        return the_balancer.start()
+
+    def run_balancer(self, threshold=10.0, max_concurrent_moves=5, **kwargs):
+        """Balance the cluster and return the time when it is balanced"""
+        self.run_until(self.start_balancer(threshold, max_concurrent_moves, **kwargs))
+        return self.env.now
+
+    def run_job(self, input_files=None, number_of_reduces=1, slots_per_node=None, **kwargs):
+        """Run a MapReduce job over input_files, all files by default, and return its completion time"""
+        if input_files is None:
+            input_files = sorted(self.namenode.metadata)
+        self.jobs.append(mapreduce.Job("job%i" % len(self.jobs), input_files, number_of_reduces, **kwargs))
+        job = self.jobs[-1]
+        scheduler = mapreduce.JobScheduler(self, slots_per_node, do_debug=self.do_debug, do_info=self.do_info,
+                                           do_warning=self.do_warning, do_critical=self.do_critical, seed=self.seed)
+        self.run_until(scheduler.submit(job))
+        return job.finish_time - job.start_time
+
     def limplock_create_30_files(self):
         """create 30 64-MB files"""
         self.put_files(30, self.block_size)
@@ -184,18 +379,32 @@ class HDFS(node.BaseSim):
 def create_hdfs(env=None, number_of_datanodes=3, replica_number=3,
                 enable_block_report=True, enable_heartbeats=True, enable_datanode_cache=True,
                 default_bandwidth=100*1024*1024/8, default_disk_speed=80*1024*1024, heartbeat_interval=3,
-                heartbeat_size=16*1024, block_report_interval=30, client_write_packet_size=1024*1024, **kwargs):
+                heartbeat_size=16*1024, block_report_interval=None, enable_incremental_block_report=True,
+                client_write_packet_size=1024*1024, max_bytes_in_flight=80*64*1024,
+                max_packets_in_flight=None, number_of_racks=1, erasure_coding_policy=None, disk_volumes=0,
+                volume_choosing_policy="round-robin", failed_volumes_tolerated=0, namenode_handler_count=10, namenode_cpu_cores=4,
+                namenode_rpc_costs=None, block_placement_policy="random", **kwargs):
     if not env:
         env = simpy.Environment()
     hdfs = HDFS(env, namenode=None, replica_number=replica_number,
                           enable_block_report=enable_block_report, enable_heartbeats=enable_heartbeats,
+                          enable_datanode_cache=enable_datanode_cache,
                           heartbeat_interval=heartbeat_interval, heartbeat_size=heartbeat_size,
-                          block_report_interval=block_report_interval, client_write_packet_size=client_write_packet_size, **kwargs)
-    namenode = node.NameNode(env, "namenode", hdfs, **kwargs)
+                          block_report_interval=block_report_interval,
+                          enable_incremental_block_report=enable_incremental_block_report,
+                          client_write_packet_size=client_write_packet_size, max_bytes_in_flight=max_bytes_in_flight,
+                          max_packets_in_flight=max_packets_in_flight, erasure_coding_policy=erasure_coding_policy,
+                          **kwargs)
+    namenode = node.NameNode(env, "namenode", hdfs, handler_count=namenode_handler_count,
+                             cpu_cores=namenode_cpu_cores, rpc_costs=namenode_rpc_costs,
+                             block_placement_policy=block_placement_policy, **kwargs)
     hdfs.set_namenode(namenode)
 
     for i in range(number_of_datanodes):
-        hdfs.create_datanode("datanode%i" % i, disk_speed=default_disk_speed, default_bandwidth=default_bandwidth)
+        hdfs.create_datanode("datanode%i" % i, disk_speed=default_disk_speed, default_bandwidth=default_bandwidth,
+                             rack="/rack%i" % (i % number_of_racks), disk_volumes=disk_volumes,
+                             volume_choosing_policy=volume_choosing_policy,
+                             failed_volumes_tolerated=failed_volumes_tolerated)
 
     return hdfs
 
@@ -211,16 +420,20 @@ def main():
     parser.add_argument('--disk-speed', type=int, default=80*1024*1024, help='disk speed')
     parser.add_argument('--nodes', type=int, default=20, help='number of datanodes')
     parser.add_argument('--files', type=int, default=30, help='number of generate files')
+    parser.add_argument('--event-log', default=None, help='record events in this binary log')
     args = parser.parse_args()
     print(args)
 
+    recorder = eventlog.EventRecorder(args.event_log) if args.event_log else None
     hdfs = create_hdfs(number_of_datanodes=args.nodes, default_disk_speed=args.disk_speed,
-                       do_debug=True,
+                       do_debug=True, recorder=recorder,
                        )
     if True:
         hdfs.put_files(args.files, 64*1024*1024)
     else:
         hdfs.regenerate_blocks(args.files)
+    if recorder:
+        recorder.close()
 
 
 if __name__ == '__main__':
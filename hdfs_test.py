@@ -39,6 +39,124 @@ class TestHDFS(unittest.TestCase):
         the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=10)
         the_hdfs.put_files(2, 64*1024*1024)
 
+    def test_pipelined_write_window(self):
+        the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=10, enable_heartbeats=False, enable_block_report=False)
+        # 80 packets of 64 KB in flight are 5 packets of 1 MB
+        self.assertEqual(the_hdfs.max_packets_in_flight, 5)
+        t = the_hdfs.put_files(1, 16*1024*1024)
+        self.assertEqual(len(the_hdfs.namenode.query_file("hello.0.txt")), 3)
+
+        stop_and_wait = hdfs.create_silent_hdfs(number_of_datanodes=10, max_packets_in_flight=1,
+                                                enable_heartbeats=False, enable_block_report=False)
+        self.assertGreater(stop_and_wait.put_files(1, 16*1024*1024), t)
+
+    def test_balancer_new_rack(self):
+        the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=3, enable_heartbeats=False, enable_block_report=False)
+        the_hdfs.put_files(4, 8*1024*1024)
+        the_hdfs.create_datanode("new0", rack="/rack-new")
+        the_hdfs.create_datanode("new1", rack="/rack-new")
+        self.assertEqual(the_hdfs.namenode.get_datanode_used("new0"), 0)
+
+        balancer = the_hdfs.start_balancer(threshold=0.0001, max_concurrent_moves=2)
+        # rebalance while the client keeps writing
+        the_hdfs.put_files(1, 8*1024*1024)
+        the_hdfs.run_until(balancer)
+        self.assertGreater(the_hdfs.namenode.get_datanode_used("new0"), 0)
+        self.assertGreater(the_hdfs.namenode.get_datanode_used("new1"), 0)
+        for file_name, datanode_names in the_hdfs.namenode.metadata.items():
+            self.assertEqual(len(set(datanode_names)), 3)
+
+    def test_erasure_coding(self):
+        replicated = hdfs.create_silent_hdfs(number_of_datanodes=6, enable_heartbeats=False, enable_block_report=False)
+        replicated.put_files(1, 12*1024*1024)
+        striped = hdfs.create_silent_hdfs(number_of_datanodes=6, enable_heartbeats=False, enable_block_report=False,
+                                          erasure_coding_policy="RS-3-2")
+        striped.put_files(1, 12*1024*1024)
+
+        datanode_names = list(striped.namenode.query_file("hello.0.txt"))
+        self.assertEqual(len(set(datanode_names)), 5)
+        self.assertEqual(striped.get_io_stats()["disk_bytes"], 20*1024*1024)
+        self.assertLess(striped.get_io_stats()["network_bytes"], replicated.get_io_stats()["network_bytes"])
+
+        self.assertGreater(striped.run_reconstruction(datanode_names[0]), 0)
+        recovered_names = striped.namenode.query_file("hello.0.txt")
+        self.assertNotIn(datanode_names[0], recovered_names)
+        self.assertEqual(len(set(recovered_names)), 5)
+        self.assertEqual(striped.datanodes[datanode_names[0]].blocks, {})
+
+    def test_erasure_coding_partial_stripe(self):
+        the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=9, enable_heartbeats=False, enable_block_report=False,
+                                           erasure_coding_policy="RS-6-3")
+        the_hdfs.put_files(1, 1024*1024)
+        datanode_names = the_hdfs.namenode.query_file("hello.0.txt")
+        # one data cell and three parity cells
+        used = [the_hdfs.namenode.get_replica_size("hello.0.txt", n) for n in datanode_names]
+        self.assertEqual(used, [1024*1024] + [0] * 5 + [1024*1024] * 3)
+        self.assertEqual(sum(used), the_hdfs.get_io_stats()["disk_bytes"])
+        self.assertEqual([len(the_hdfs.datanodes[n].blocks) for n in datanode_names], [1] + [0] * 5 + [1] * 3)
+
+    def test_volume_failure(self):
+        the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=4, enable_heartbeats=False, enable_block_report=False,
+                                           disk_volumes=2, failed_volumes_tolerated=1)
+        the_hdfs.put_files(4, 4*1024*1024)
+        datanode = the_hdfs.datanodes["datanode0"]
+        lost_files = [f for f, v in datanode.stream_volumes.items() if v is datanode.volumes[0]]
+        self.assertGreater(the_hdfs.run_volume_failure("datanode0", 0), 0)
+        self.assertTrue(datanode.disk_alive.triggered)
+        for file_name in lost_files:
+            self.assertNotIn("datanode0", the_hdfs.namenode.query_file(file_name))
+            self.assertEqual(len(set(the_hdfs.namenode.query_file(file_name))), 3)
+
+    def test_namenode_saturation(self):
+        def heartbeat_wait(cores):
+            the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=50, heartbeat_interval=1, enable_block_report=False,
+                                               namenode_cpu_cores=cores, namenode_rpc_costs={"heartbeat": 0.05})
+            the_hdfs.run_until(60)
+            stats = the_hdfs.namenode.rpc_stats["heartbeat"]
+            return float(stats["wait"]) / stats["count"], the_hdfs.namenode.get_cpu_utilization()
+
+        saturated_wait, saturated_utilization = heartbeat_wait(1)
+        wait, utilization = heartbeat_wait(8)
+        self.assertGreater(saturated_utilization, 0.9)
+        self.assertLess(utilization, saturated_utilization)
+        self.assertGreater(saturated_wait, 10 * wait)
+
+    def test_heartbeat_started_twice(self):
+        def heartbeats(starts):
+            the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=1, enable_heartbeats=False, enable_block_report=False)
+            for i in range(starts):
+                the_hdfs.datanodes["datanode0"].start_heartbeat(3, 1024)
+            the_hdfs.run_until(60)
+            return the_hdfs.namenode.rpc_stats["heartbeat"]["count"]
+
+        self.assertEqual(heartbeats(2), heartbeats(1))
+
+    def test_incremental_block_report(self):
+        def control_plane(enable_incremental_block_report):
+            the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=20, enable_heartbeats=False, block_report_interval=60,
+                                               enable_incremental_block_report=enable_incremental_block_report)
+            the_hdfs.put_files(5, 1024*1024)
+            the_hdfs.run_until(120)
+            return the_hdfs, the_hdfs.get_control_plane_stats()
+
+        the_hdfs, stats = control_plane(True)
+        for datanode_name in the_hdfs.namenode.query_file("hello.0.txt"):
+            self.assertIn("hello.0.txt", the_hdfs.datanodes[datanode_name].blocks)
+        self.assertEqual(sum([len(d.blocks) for d in the_hdfs.datanodes.values()]), 15)
+        self.assertGreater(stats["rpc"]["incremental_block_report"]["count"], 0)
+        self.assertGreater(stats["incremental_block_report_bytes"], 0)
+
+        fixed_hdfs, fixed_stats = control_plane(False)
+        self.assertNotIn("incremental_block_report", fixed_stats["rpc"])
+        # changes nothing reports are not kept
+        self.assertEqual(sum([len(d.pending_block_changes) for d in fixed_hdfs.datanodes.values()]), 0)
+        self.assertLess(stats["block_report_bytes"] + stats["incremental_block_report_bytes"],
+                        fixed_stats["block_report_bytes"] / 100)
+        # a fixed report lists about 50k blocks, which costs the NameNode far more than the stored ones
+        self.assertLess(stats["namenode_cpu_utilization"], fixed_stats["namenode_cpu_utilization"] / 10)
+        self.assertEqual(hdfs.create_silent_hdfs().block_report_interval, 6 * 3600)
+        self.assertEqual(hdfs.create_silent_hdfs(enable_incremental_block_report=False).block_report_interval, 30)
+
 
 if __name__ == '__main__':
     unittest.main()
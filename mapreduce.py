@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""MapReduce jobs over the files stored in HDFS
+Attributes:
+    LOCALITY_LEVELS: how close a map task runs to a replica of its input split, best first
+
+A job has one map task per block of its input files. Every datanode runs slots_per_node task
+slots, cpu_cores by default. Whenever slots are free, the scheduler first gives every free slot it
+can a map task whose input its datanode stores, then a task stored on its rack, then any other, so
+a slot never takes a task another free slot would run node-local. A map task reads its split from the local disk
+or streams it across the Switch, computes, and spills its output to the local disk. Once every map
+task is done, reduce tasks fetch their partition of every map output across the Switch, compute,
+and write their output locally.
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+import math
+
+from simpy.events import AllOf
+
+import node
+
+
+LOCALITY_LEVELS = ("node-local", "rack-local", "remote")
+
+
+class Job(object):
+    def __init__(self, job_id, input_files, number_of_reduces=1, map_speed=64*1024*1024,
+                 map_output_ratio=1.0, reduce_speed=64*1024*1024, reduce_output_ratio=1.0):
+        """map_speed and reduce_speed are bytes one core processes per second"""
+        self.id = job_id
+        self.input_files = input_files
+        #: mapreduce.job.reduces
+        self.number_of_reduces = number_of_reduces
+        self.map_speed = map_speed
+        #: map output bytes per input byte
+        self.map_output_ratio = map_output_ratio
+        self.reduce_speed = reduce_speed
+        #: reduce output bytes per shuffled byte
+        self.reduce_output_ratio = reduce_output_ratio
+
+        self.start_time = None
+        self.finish_time = None
+        #: (datanode, map output bytes) of every finished map task
+        self.map_outputs = []
+        self.locality = dict([(level, 0) for level in LOCALITY_LEVELS])
+        #: map output bytes sent across the Switch
+        self.shuffled_bytes = 0
+        self.pending_maps = []
+        self.pending_reduces = []
+        #: datanode of every free task slot
+        self.free_slots = []
+        self.running_maps = 0
+        self.maps_done = None
+
+
+class JobScheduler(node.BaseSim):
+    """Run a job on the task slots of the alive datanodes"""
+
+    def __init__(self, hdfs, slots_per_node=None, **kwargs):
+        super(JobScheduler, self).__init__(**kwargs)
+
+        self.env = hdfs.env
+        self.id = "scheduler"
+        self.hdfs = hdfs
+        self.namenode = hdfs.namenode
+        #: concurrent tasks on one datanode, None for its cpu_cores
+        self.slots_per_node = slots_per_node
+
+    def get_map_tasks(self, job):
+        """One task per block: (file name, block index, split size, datanodes storing it)"""
+        tasks = []
+        for file_name in job.input_files:
+            size = self.namenode.file_sizes[file_name]
+            datanode_names = self.namenode.metadata[file_name]
+            policy = self.namenode.erasure_coding.get(file_name)
+            if policy:
+                # internal blocks are striped: no datanode stores a whole split
+                datanode_names = []
+            for i in range(self.hdfs.get_number_of_blocks(size)):
+                split_size = min(self.hdfs.block_size, size - i * self.hdfs.block_size)
+                tasks.append((file_name, i, split_size, datanode_names))
+        return tasks
+
+    def get_locality(self, datanode_name, locations):
+        if datanode_name in locations:
+            return "node-local"
+        rack = self.hdfs.datanodes[datanode_name].rack
+        if [n for n in locations if self.hdfs.datanodes[n].rack == rack]:
+            return "rack-local"
+        return "remote"
+
+    def find_map_task(self, job, datanode_name, locality):
+        """Return the first pending map task with this locality on the datanode, or None"""
+        for task in job.pending_maps:
+            locations = [n for n in task[3] if self.hdfs.datanodes[n].disk_alive.triggered]
+            if self.get_locality(datanode_name, locations) == locality:
+                return task
+        return None
+
+    def assign_map_tasks(self, job):
+        """Match free slots with pending map tasks: every node-local pair first, then rack-local, then remote"""
+        for locality in LOCALITY_LEVELS:
+            for datanode_name in list(job.free_slots):
+                task = self.find_map_task(job, datanode_name, locality)
+                if task is None:
+                    continue
+                job.free_slots.remove(datanode_name)
+                job.pending_maps.remove(task)
+                job.running_maps += 1
+                self.env.process(self._map_slot(job, datanode_name, task, locality))
+
+    def get_workers(self):
+        workers = []
+        for datanode_name, datanode in sorted(self.hdfs.datanodes.items()):
+            if not datanode.disk_alive.triggered:
+                continue
+            for slot in range(self.slots_per_node or datanode.cpu_cores):
+                workers.append(datanode_name)
+        return workers
+
+    def submit(self, job):
+        return self.env.process(self._run_job(job))
+
+    def _run_job(self, job):
+        job.start_time = self.env.now
+        job.pending_maps = self.get_map_tasks(job)
+        self.info("JOB\t%s\t%i maps\t%i reduces" % (job.id, len(job.pending_maps), job.number_of_reduces))
+        workers = self.get_workers()
+        if not workers:
+            raise node.SimulatorException("no alive datanode could run %s" % job.id)
+        job.free_slots = list(workers)
+        job.maps_done = self.env.event()
+        if job.pending_maps:
+            self.assign_map_tasks(job)
+            yield job.maps_done
+
+        # reduces start once all maps are done, as with mapreduce.job.reduce.slowstart.completedmaps=1
+        job.pending_reduces = list(range(job.number_of_reduces))
+        yield AllOf(self.env, [self.env.process(self._reduce_slot(job, n)) for n in workers])
+        job.finish_time = self.env.now
+        self.critical("JOB\t%s\tfinished in %.3fs\t%s" % (job.id, job.finish_time - job.start_time, job.locality))
+
+    def _map_slot(self, job, datanode_name, task, locality):
+        yield self.env.process(self._map(job, datanode_name, task, locality))
+        job.running_maps -= 1
+        job.free_slots.append(datanode_name)
+        if job.pending_maps:
+            self.assign_map_tasks(job)
+        elif job.running_maps == 0:
+            job.maps_done.succeed()
+
+    def _map(self, job, datanode_name, task, locality):
+        file_name, index, split_size, locations = task
+        job.locality[locality] += 1
+        self.debug("MAP\t%s:%i\t%s\t%s" % (file_name, index, datanode_name, locality))
+        if locality == "node-local":
+            yield self.hdfs.datanodes[datanode_name].new_disk_read_request(split_size, file_name)
+        else:
+            yield self.read_remote_split(file_name, split_size, datanode_name, locations)
+        yield self.env.timeout(float(split_size) / job.map_speed)
+        output_size = int(split_size * job.map_output_ratio)
+        if output_size > 0:
+            yield self.hdfs.store_data(datanode_name, output_size)
+        job.map_outputs.append((datanode_name, output_size))
+
+    def read_remote_split(self, file_name, split_size, datanode_name, locations):
+        """Stream the split from a replica on the rack of the datanode if any, or from data_units internal blocks"""
+        alive = [n for n in self.namenode.metadata[file_name] if self.hdfs.datanodes[n].disk_alive.triggered]
+        if not alive:
+            raise node.SimulatorException("no alive datanode stores %s" % file_name)
+        if locations:
+            rack = self.hdfs.datanodes[datanode_name].rack
+            same_rack = [n for n in alive if self.hdfs.datanodes[n].rack == rack]
+            return self.hdfs.stream_data((same_rack or alive)[0], datanode_name, split_size, stream=file_name)
+        data_units = node.ERASURE_CODING_POLICIES[self.namenode.erasure_coding[file_name]][0]
+        cell_size = int(math.ceil(float(split_size) / data_units))
+        return AllOf(self.env, [self.hdfs.stream_data(n, datanode_name, cell_size, stream=file_name)
+                                for n in alive[:data_units]])
+
+    def _reduce_slot(self, job, datanode_name):
+        while job.pending_reduces:
+            partition = job.pending_reduces.pop(0)
+            yield self.env.process(self._reduce(job, datanode_name, partition))
+
+    def _reduce(self, job, datanode_name, partition):
+        """Fetch this partition of every map output, then reduce it"""
+        fetches = []
+        shuffled_bytes = 0
+        for map_datanode_name, output_size in job.map_outputs:
+            size = output_size // job.number_of_reduces
+            if size <= 0:
+                continue
+            shuffled_bytes += size
+            if map_datanode_name == datanode_name:
+                fetches.append(self.hdfs.datanodes[datanode_name].new_disk_read_request(size))
+            else:
+                fetches.append(self.hdfs.stream_data(map_datanode_name, datanode_name, size))
+                job.shuffled_bytes += size
+        yield AllOf(self.env, fetches)
+        self.debug("REDUCE\t%s:%i\t%s\t%i bytes" % (job.id, partition, datanode_name, shuffled_bytes))
+        yield self.env.timeout(float(shuffled_bytes) / job.reduce_speed)
+        output_size = int(shuffled_bytes * job.reduce_output_ratio)
+        if output_size > 0:
+            yield self.hdfs.store_data(datanode_name, output_size)
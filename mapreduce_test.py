@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Brief Summary
+Attributes:
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+
+import unittest
+
+import hdfs
+
+
+class TestMapReduce(unittest.TestCase):
+    def create_hdfs(self, **kwargs):
+        the_hdfs = hdfs.create_silent_hdfs(number_of_datanodes=6, number_of_racks=2, enable_heartbeats=False,
+                                           enable_block_report=False, seed=1, **kwargs)
+        the_hdfs.put_files(6, 16*1024*1024)
+        return the_hdfs
+
+    def test_job(self):
+        the_hdfs = self.create_hdfs()
+        t = the_hdfs.run_job(number_of_reduces=2)
+        self.assertGreater(t, 0)
+        job = the_hdfs.jobs[0]
+        self.assertEqual(sum(job.locality.values()), 6)
+        self.assertEqual(len(job.map_outputs), 6)
+        # every split has a replica on a datanode with a free slot
+        self.assertEqual(job.locality["node-local"], 6)
+        self.assertGreater(job.shuffled_bytes, 0)
+
+    def test_more_replicas_more_locality(self):
+        single = self.create_hdfs(replica_number=1)
+        single.run_job(slots_per_node=1)
+        replicated = self.create_hdfs(replica_number=3)
+        replicated.run_job(slots_per_node=1)
+        self.assertLess(single.jobs[0].locality["node-local"], 6)
+        self.assertGreaterEqual(replicated.jobs[0].locality["node-local"], single.jobs[0].locality["node-local"])
+
+    def test_rack_aware_placement(self):
+        the_hdfs = self.create_hdfs(block_placement_policy="rack-aware")
+        for datanode_names in the_hdfs.namenode.metadata.values():
+            racks = [the_hdfs.datanodes[n].rack for n in datanode_names]
+            self.assertNotEqual(racks[0], racks[1])
+            self.assertEqual(racks[1], racks[2])
+
+    def test_striped_input(self):
+        the_hdfs = self.create_hdfs(erasure_coding_policy="RS-3-2")
+        the_hdfs.run_job()
+        self.assertEqual(the_hdfs.jobs[0].locality["node-local"], 0)
+        self.assertEqual(len(the_hdfs.jobs[0].map_outputs), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,28 +8,47 @@ http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
 """
 __copyright__ = "Zhaoyu Luo"
 
+import math
 import random
 
 import simpy
 from simpy.events import AllOf
 
+import eventlog
 
-def get_network_latency(latency, bandwidth, queue):
+
+def get_network_latency(latency, bandwidth, queue, random_stream=random):
     """Simulate a real world link latency"""
     queue_count = len(queue)
     buffered_size = sum([p['size'] for p in queue])
     max_buffer_size = 9 * 1024 * 1024
     return 0
-    return (0.5 + random.random()) * latency * (1 + buffered_size / max_buffer_size)
+    return (0.5 + random_stream.random()) * latency * (1 + buffered_size / max_buffer_size)
 
 
-def get_backoff(backoff_level):
-    backoff = float(max(1, random.randint(0, int(min(5*1000, # backoff wait <= 5s
-                                                    2**min(30, backoff_level)-1))))) / 1000
-    return random.random() / 10
+def get_backoff(backoff_level, random_stream=random):
+    backoff = float(max(1, random_stream.randint(0, int(min(5*1000, # backoff wait <= 5s
+                                                           2**min(30, backoff_level)-1))))) / 1000
+    return random_stream.random() / 10
     return backoff
 
 
+def get_random_stream(seed, name):
+    """A random stream for one component: components of two runs with the same seed draw the same numbers"""
+    if seed is None:
+        return random.Random()
+    return random.Random("%s:%s" % (seed, name))
+
+
+#: erasure coding policy name -> (number of data units, number of parity units)
+ERASURE_CODING_POLICIES = {
+    "RS-3-2": (3, 2),
+    "RS-6-3": (6, 3),
+    "RS-10-4": (10, 4),
+    "XOR-2-1": (2, 1),
+}
+
+
 class SimulatorException(Exception):
     pass
 
@@ -40,11 +59,27 @@ def _debugprint(env, msg, do=True):
 
 
 class BaseSim(object):
-    def __init__(self, do_info=True, do_warning=True, do_debug=False, do_critical=True):
+    def __init__(self, do_info=True, do_warning=True, do_debug=False, do_critical=True, recorder=None, seed=None):
         self.do_info = do_info
         self.do_warning = do_warning
         self.do_debug = do_debug
         self.do_critical = do_critical
+        #: an eventlog.EventRecorder, or None to record nothing
+        self.recorder = recorder
+        #: seed of the random stream of this component, None for an unseeded stream
+        self.seed = seed
+        self._random_stream = None
+
+    @property
+    def random_stream(self):
+        """Created on first use, since subclasses set their id after BaseSim.__init__"""
+        if self._random_stream is None:
+            self._random_stream = get_random_stream(self.seed, self.id)
+        return self._random_stream
+
+    def record(self, event_type, src, dst, size, duration):
+        if self.recorder:
+            self.recorder.record(self.env.now, event_type, src, dst, size, duration)
 
     def info(self, msg):
         msg = "INFO\tid:%s\t%s" % (self.id, msg)
@@ -63,10 +98,94 @@ class BaseSim(object):
         _debugprint(self.env, msg, self.do_critical)
 
 
+#: a volume serves queued reads before queued writes
+READ_PRIORITY = 0
+WRITE_PRIORITY = 1
+
+
+class Volume(BaseSim):
+    """One disk of a JBOD datanode: it has its own bandwidth, seek cost, and read and write queues"""
+
+    def __init__(self, env, volume_id, capacity, speed, seek_time=0.008, **kwargs):
+        super(Volume, self).__init__(**kwargs)
+
+        self.env = env
+        self.id = volume_id
+        self.capacity = capacity
+        self.used = 0
+        self.speed = speed
+        self.seek_time = seek_time
+        #: one disk head serves one IO at a time
+        self.spindle = simpy.PriorityResource(self.env, capacity=1)
+        self.is_alive = True
+        #: consecutive IOs of the same stream need no seek
+        self.last_stream = None
+        self.read_bytes = 0
+        self.written_bytes = 0
+        self.busy_time = 0
+
+    @property
+    def available(self):
+        return self.capacity - self.used
+
+    @property
+    def read_queue(self):
+        return [r for r in self.spindle.queue if r.priority == READ_PRIORITY]
+
+    @property
+    def write_queue(self):
+        return [r for r in self.spindle.queue if r.priority == WRITE_PRIORITY]
+
+    def read(self, size, stream=None):
+        return self.env.process(self._io(size, READ_PRIORITY, stream))
+
+    def write(self, size, stream=None):
+        """The caller should have reserved the space"""
+        return self.env.process(self._io(size, WRITE_PRIORITY, stream))
+
+    def reserve(self, size):
+        self.used += size
+
+    def fail(self):
+        self.is_alive = False
+        self.record(eventlog.FAILURE, self.id, self.id, self.used, 0)
+        self.critical("VOLUME_FAILED\t%4.2f MB lost" % (float(self.used)/1024/1024))
+
+    def _io(self, size, priority, stream=None):
+        """Return whether the IO completes on a live volume"""
+        with self.spindle.request(priority=priority) as req:
+            yield req
+            if not self.is_alive:
+                return False
+            io_time = float(size) / self.speed
+            if stream is None or stream != self.last_stream:
+                io_time += self.seek_time
+            self.last_stream = stream
+            yield self.env.timeout(io_time)
+            self.busy_time += io_time
+        self.record(eventlog.DISK_READ if priority == READ_PRIORITY else eventlog.DISK_WRITE,
+                    self.id, self.id, size, io_time)
+        if priority == READ_PRIORITY:
+            self.read_bytes += size
+        else:
+            self.written_bytes += size
+        self.debug("%s\t%4.2f KB in %4.2fms" % ("READ" if priority == READ_PRIORITY else "WRITE",
+                                                float(size)/1024, io_time*1000))
+        return self.is_alive
+
+
 class Node(BaseSim):
     def __init__(self, env, node_id, ip="127.0.0.1", cpu_cores=4, memory=8*1024*1024*1024, disk=320*1024*1024*1024,
-                 disk_speed=80*1024*1024, default_bandwidth=100*1024*1024/8, disk_buffer=512*1024*1024, **kwargs):
-        "One node is a resouce entity"
+                 disk_speed=80*1024*1024, default_bandwidth=100*1024*1024/8, disk_buffer=512*1024*1024,
+                 tx_bandwidth=None, rx_bandwidth=None, rack="/default-rack", disk_volumes=0, volume_seek_time=0.008, volume_choosing_policy="round-robin",
+                 failed_volumes_tolerated=0, **kwargs):
+        """One node is a resouce entity
+
+        The NIC is full-duplex: transmit and receive channels are queued independently, and run at
+        tx_bandwidth and rx_bandwidth, which default to default_bandwidth.
+        With disk_volumes > 0, the disk is a JBOD of that many volumes, each as fast as disk_speed.
+        Like HDFS, the whole disk breaks with its first failed volume unless failed_volumes_tolerated is raised.
+        """
         super(Node, self).__init__(**kwargs)
 
         self.env = env
@@ -78,18 +197,23 @@ class Node(BaseSim):
         # assume we are SMP
         self.disk = disk
         self.ip = ip
+        self.rack = rack
         self.memory_speed = 10 * 1024 * 1024 * 1024
 
         self.memory_controller = simpy.Resource(self.env, capacity=1)
         self.disk_buffer = simpy.Container(self.env, init=disk_buffer, capacity=disk_buffer)
         #self.bandwidth = simpy.Container(self.env, init=default_bandwidth, capacity=default_bandwidth)
         self.bandwidth = default_bandwidth
-        self.link = simpy.Resource(self.env, capacity=1)
-        #self.link = simpy.PriorityResource(self.env, capacity=1)
+        self.tx_bandwidth = tx_bandwidth or default_bandwidth
+        self.rx_bandwidth = rx_bandwidth or default_bandwidth
+        self.tx_link = simpy.Resource(self.env, capacity=1)
+        self.rx_link = simpy.Resource(self.env, capacity=1)
         self.set_disk_speed(disk_speed)
 
         self.disk_events = {}
         self.active_disk_events = {}
+        #: bytes written to the disk buffer or the disk
+        self.disk_written_bytes = 0
         self.event_id = 0
         self.is_disk_alive = True
         self.disk_buffer_flush_frequency = 30
@@ -97,6 +221,27 @@ class Node(BaseSim):
         self.disk_alive = self.env.event()
         self.disk_alive.succeed("initial disk is fine")
         self.disk_buffer_full = self.env.event()
+
+        self.volumes = []
+        for i in range(disk_volumes):
+            self.volumes.append(Volume(self.env, "%s:volume%i" % (self.id, i), disk / disk_volumes, disk_speed,
+                                       seek_time=volume_seek_time, do_info=self.do_info, do_warning=self.do_warning,
+                                       do_debug=self.do_debug, do_critical=self.do_critical, recorder=self.recorder,
+                                       seed=self.seed))
+        if volume_choosing_policy not in ("round-robin", "available-space"):
+            raise SimulatorException("unknown volume choosing policy: %s" % volume_choosing_policy)
+        self.volume_choosing_policy = volume_choosing_policy
+        #: dfs.datanode.failed.volumes.tolerated
+        self.failed_volumes_tolerated = failed_volumes_tolerated
+        #: dfs.datanode.available-space-volume-choosing-policy.balanced-space-threshold
+        self.balanced_space_threshold = 10 * 1024 * 1024 * 1024
+        #: dfs.datanode.available-space-volume-choosing-policy.balanced-space-preference-fraction
+        self.balanced_space_preference_fraction = 0.75
+        self.next_volume = 0
+        #: stream (block) name -> the volume storing it
+        self.stream_volumes = {}
+        #: volume -> bytes in the disk buffer waiting to be flushed to it
+        self.dirty_bytes = {}
         self.init_disk_flush_loop()
 
     def set_disk_speed(self, disk_speed):
@@ -109,6 +254,7 @@ class Node(BaseSim):
         if delay > 0:
             yield self.env.timeout(delay)
         self.disk_alive = self.env.event()
+        self.record(eventlog.FAILURE, self.id, self.id, 0, 0)
         for k, e in self.active_disk_events.items():
             e.interrupt({"info": "Disk gets broken", "time": self.env.now})
 
@@ -120,20 +266,96 @@ class Node(BaseSim):
             yield self.env.timeout(delay)
         self.disk_alive.succeed()
 
-    def new_disk_write_request(self, total_bytes, delay=0):
+    def process_fail_volume(self, volume_index, delay=0):
+        return self.env.process(self._fail_volume(volume_index, delay))
+
+    def _fail_volume(self, volume_index, delay=0):
+        """Return the streams lost with the volume; the whole disk breaks beyond failed_volumes_tolerated"""
+        if delay > 0:
+            yield self.env.timeout(delay)
+        volume = self.volumes[volume_index]
+        volume.fail()
+        self.dirty_bytes.pop(volume, None)
+        lost_streams = sorted([s for s, v in self.stream_volumes.items() if v is volume])
+        for s in lost_streams:
+            self.stream_volumes.pop(s)
+        if len([v for v in self.volumes if not v.is_alive]) > self.failed_volumes_tolerated:
+            self.critical("too many failed volumes, shut down the disk")
+            yield self.env.process(self._break_disk())
+        return lost_streams
+
+    def choose_volume(self, size, stream=None):
+        """A stream stays on the volume of its first write, new streams are placed by the policy"""
+        volume = self.stream_volumes.get(stream)
+        if volume is not None and volume.is_alive:
+            return volume
+        candidates = [v for v in self.volumes if v.is_alive and v.available >= size]
+        if not candidates:
+            raise SimulatorException("%s has no volume with %i bytes available" % (self.id, size))
+        if self.volume_choosing_policy == "available-space":
+            least_available = min([v.available for v in candidates])
+            most_available = max([v.available for v in candidates])
+            if most_available - least_available > self.balanced_space_threshold:
+                high = [v for v in candidates if v.available > least_available + self.balanced_space_threshold]
+                low = [v for v in candidates if v not in high]
+                if self.random_stream.random() < self.balanced_space_preference_fraction:
+                    candidates = high
+                else:
+                    candidates = low
+        volume = candidates[self.next_volume % len(candidates)]
+        self.next_volume += 1
+        if stream is not None:
+            self.stream_volumes[stream] = volume
+        return volume
+
+    def new_disk_read_request(self, total_bytes, stream=None):
+        return self.env.process(self._read_disk(total_bytes, stream))
+
+    def _read_disk(self, total_bytes, stream=None):
+        yield self.disk_alive
+        if not self.volumes:
+            yield self.new_disk_io_request(total_bytes, is_write=False)
+            return
+        volume = self.stream_volumes.get(stream)
+        if volume is None or not volume.is_alive:
+            volume = self.choose_volume(0)
+        yield volume.read(total_bytes, stream)
+
+    def new_disk_write_request(self, total_bytes, delay=0, stream=None):
         """This is called by client"""
+        if self.volumes:
+            self.event_id += 1
+            return self.env.process(self._write_volume(total_bytes, self.event_id, delay, stream))
+        return self.new_disk_io_request(total_bytes, delay)
+
+    def new_disk_io_request(self, total_bytes, delay=0, is_write=True):
+        """Read or write the single disk, sharing its bandwidth with every other read and write"""
         self.event_id += 1
         event_id = self.event_id
-        new_event = self.env.process(self._write_disk(total_bytes, event_id, delay))
+        new_event = self.env.process(self._use_disk(total_bytes, event_id, delay, is_write))
         self.disk_events[event_id] = new_event
         return new_event
 
-    def new_disk_buffer_write_request(self, total_bytes, delay=0):
+    def new_disk_buffer_write_request(self, total_bytes, delay=0, stream=None):
         self.event_id += 1
         event_id = self.event_id
-        new_event = self.env.process(self._write_disk_buffer(total_bytes, event_id, delay))
+        new_event = self.env.process(self._write_disk_buffer(total_bytes, event_id, delay, stream))
         return new_event
 
+    def _write_volume(self, total_bytes, event_id, delay=0, stream=None):
+        if delay > 0:
+            yield self.env.timeout(delay)
+        while True:
+            yield self.disk_alive
+            volume = self.choose_volume(total_bytes, stream)
+            volume.reserve(total_bytes)
+            succeeded = yield volume.write(total_bytes, stream if stream is not None else event_id)
+            if succeeded:
+                break
+            self.warning("%s\t%s failed, rewrite %4.2f MB" % (event_id, volume.id, float(total_bytes)/1024/1024))
+        self.disk_written_bytes += total_bytes
+        self.info("%s\t%i MB written on %s" % (event_id, total_bytes/1024/1024, volume.id))
+
     def init_disk_flush_loop(self):
         self.info("start disk flush loop")
         self.env.process(self._flush_disk_when_full())
@@ -146,24 +368,39 @@ class Node(BaseSim):
             yield self.disk_buffer_full | flush_frequency
             buffered_bytes = self.disk_buffer.capacity - self.disk_buffer.level
             self.debug("DISK_FLUSH_START\t%4.2f KB" % (buffered_bytes/1024))
-            if buffered_bytes > 0:
+            if buffered_bytes > 0 and self.volumes:
+                # every volume flushes its own dirty bytes in parallel
+                start_time = self.env.now
+                dirty_bytes, self.dirty_bytes = self.dirty_bytes, {}
+                yield AllOf(self.env, [v.write(b, stream="flush") for v, b in dirty_bytes.items() if v.is_alive])
+                yield self.disk_buffer.put(buffered_bytes)
+                self.record(eventlog.DISK_FLUSH, self.id, self.id, buffered_bytes, self.env.now - start_time)
+                self.info("DISK_FLUSH_COMPLETE\t%4.2fs" % (self.env.now - start_time))
+            elif buffered_bytes > 0:
                 # then flush cache TODO: here is assuming we acquire the disk exclusively
                 flush_time = float(buffered_bytes) / self.disk_speed.capacity
                 yield self.env.timeout(flush_time)
                 yield self.disk_buffer.put(buffered_bytes)
+                self.record(eventlog.DISK_FLUSH, self.id, self.id, buffered_bytes, flush_time)
                 self.info("DISK_FLUSH_COMPLETE\t%4.2fs" % (flush_time))
             self.disk_buffer_full = self.env.event()
 
-    def _write_disk_buffer(self, total_bytes, event_id, delay=0):
+    def _write_disk_buffer(self, total_bytes, event_id, delay=0, stream=None):
         if delay > 0:
             yield self.env.timeout(delay)
+        volume = None
+        if self.volumes:
+            volume = self.choose_volume(total_bytes, stream)
+            # reserve the space now, the flush loop writes the dirty bytes later
+            volume.reserve(total_bytes)
+        request_time = self.env.now
         written_bytes = 0
         while written_bytes < total_bytes:
             # firstly, acquire memory controller
             with self.memory_controller.request() as req:
                 yield req
                 if self.disk_buffer.level == 0: # if buffer is full
-                    sleep_time = random.random()
+                    sleep_time = self.random_stream.random()
                     self.debug("BUFFER_FULL:%s sleep %4.2f\t%4.2f/%4.2f MB"
                                % (event_id, sleep_time, written_bytes/1024/1024, total_bytes/1024/1024))
                     yield self.env.timeout(sleep_time)
@@ -177,15 +414,21 @@ class Node(BaseSim):
                     if self.disk_buffer.level == 0:
                         self.disk_buffer_full.succeed()
                     written_bytes += writable_bytes
+                    if volume is not None:
+                        self.dirty_bytes[volume] = self.dirty_bytes.get(volume, 0) + writable_bytes
                     self.debug("DISK_WROTE_ONCE:%s\t%4.2f KB: %4.2f/%4.2f MB"
                                % (event_id, writable_bytes/1024, written_bytes/1024/1024, total_bytes/1024/1024))
+        self.disk_written_bytes += written_bytes
+        self.record(eventlog.BUFFER_WRITE, self.id, self.id, written_bytes, self.env.now - request_time)
         self.info("DISK_WROTE:%s\t%4.2f MB"
                    % (event_id, written_bytes/1024/1024))
 
-    def _write_disk(self, total_bytes, event_id, delay=0):
+    def _use_disk(self, total_bytes, event_id, delay=0, is_write=True):
         if delay > 0:
             yield self.env.timeout(delay)
         self.active_disk_events[event_id] = self.disk_events[event_id]
+        #: when the disk started serving this IO, waiting for a broken disk or for bandwidth excluded
+        service_start_time = None
         written_bytes = 0
         current_speed = 0
 
@@ -216,6 +459,8 @@ class Node(BaseSim):
                 current_speed = ideal_speed
                 estimated_finish_time = (total_bytes - written_bytes) / current_speed
                 start_time = self.env.now
+                if service_start_time is None:
+                    service_start_time = start_time
                 try:
                     yield self.env.timeout(estimated_finish_time)
                 except simpy.Interrupt as e:
@@ -226,7 +471,7 @@ class Node(BaseSim):
             else:
                 # It MUST wait for a random time to allow interrupted tasks to yield their disk IO
                 try:
-                    yield self.env.timeout(random.random())
+                    yield self.env.timeout(self.random_stream.random())
                 except simpy.Interrupt: # there is no point to interrupt a poor guy, so just let me ignore that
                     continue
                 self.debug("%s\tinterrupting\t%4.2f/%4.2f MB written\tspeed_request: %4.1f/%4.1f MB/s"
@@ -236,14 +481,19 @@ class Node(BaseSim):
                         e.interrupt({"info": "Task %s needs disk" % event_id, "time": self.env.now})
 
         # event finished
+        if is_write:
+            self.disk_written_bytes += total_bytes
+        self.record(eventlog.DISK_WRITE if is_write else eventlog.DISK_READ, self.id, self.id, total_bytes,
+                    self.env.now - service_start_time)
         self.disk_events.pop(event_id)
         self.active_disk_events.pop(event_id)
         if current_speed > 0 and self.disk_speed.level < self.disk_speed.capacity:
             yield self.disk_speed.put(min(current_speed, self.disk_speed.capacity - self.disk_speed.level))
         for k, e in self.active_disk_events.items():
             e.interrupt({"info": "%s release disk" % event_id, "time": self.env.now})
-        self.info("%s\t%i MB written\t%i MB/s bandwidth released\tidle disk: %i MB/s"
-                   % (event_id, total_bytes/1024/1024, current_speed/1024/1024, self.disk_speed.level/1024/1024))
+        self.info("%s\t%i MB %s\t%i MB/s bandwidth released\tidle disk: %i MB/s"
+                   % (event_id, total_bytes/1024/1024, "written" if is_write else "read", current_speed/1024/1024,
+                      self.disk_speed.level/1024/1024))
 
 
 class Switch(BaseSim):
@@ -255,6 +505,8 @@ class Switch(BaseSim):
         self.network = {}
         self.id = switch_id
         self.latency = latency
+        #: bytes sent through _ping
+        self.transferred_bytes = 0
 
         #: e.g., {("192.168.0.1", "172.16.0.1"): 3}: ping from 192.168.0.1 to 172.16.0.1 every 3s
         self.heartbeats = {}
@@ -272,13 +524,13 @@ class Switch(BaseSim):
         self.env.process(self._serve_link(node_id))
 
     def _serve_link(self, node_id):
-        the_bandwidth = self.network[node_id]["node"].bandwidth
+        the_bandwidth = self.network[node_id]["node"].rx_bandwidth
         self.info("Start serving link between %s and %s: %4.2f MB/s" % (self.id, node_id, float(the_bandwidth)/1024/1024))
         while True:
             # wating event succeed, which indicates there is event coming
             yield self.network[node_id]["active"]
             while self.network[node_id]["queue"]:
-                with self.network[node_id]["node"].link.request() as req:
+                with self.network[node_id]["node"].rx_link.request() as req:
                     yield req
 
                     packet_event = self.network[node_id]["queue"].pop(0)
@@ -287,6 +539,7 @@ class Switch(BaseSim):
                     the_latency = get_network_latency(self.latency, the_bandwidth, self.network[node_id]["queue"])
                     + float(packet_event['size'])/the_bandwidth
                     yield self.env.timeout(the_latency)
+                    self.record(eventlog.TRANSFER, packet_event['from'], node_id, packet_event['size'], the_latency)
                     self.debug("DOWN:%s->%s: %i KB %4.2f MB/s %ims" %
                                (packet_event['from'], node_id, float(packet_event['size']) / 1024, float(the_bandwidth) / 1024 / 1024, the_latency * 1000))
                     packet_event['event'].succeed()
@@ -315,47 +568,99 @@ class Switch(BaseSim):
         """TODO: need to implement slow start"""
         if delay > 0:
             yield self.env.timeout(delay)
-        yield self.env.timeout(random.random()/100)
+        yield self.env.timeout(self.random_stream.random()/100)
 
-        req_from = self.network[from_node_id]['node'].link.request()
-        req_to = self.network[to_node_id]['node'].link.request()
+        req_from = self.network[from_node_id]['node'].tx_link.request()
+        req_to = self.network[to_node_id]['node'].rx_link.request()
         #: this should not happen, 
         req_timeout = self.env.timeout(24*3600)
 #        self.debug("NETWORK_PREPARE\t%s:%s->%s:%s: %.1f KB" %
-#                   (from_node_id, len(self.network[from_node_id]['node'].link.queue),
-#                    to_node_id, len(self.network[to_node_id]['node'].link.queue),
+#                   (from_node_id, len(self.network[from_node_id]['node'].tx_link.queue),
+#                    to_node_id, len(self.network[to_node_id]['node'].rx_link.queue),
 #                    packet_size/1024))
         yield (req_from & req_to) | req_timeout
         if req_timeout.processed:
             self.critical("NETWORK_TIMEOUT\t%s:%s->%s:%s: %.1f KB" %
-                       (from_node_id, len(self.network[from_node_id]['node'].link.queue),
-                        to_node_id, len(self.network[to_node_id]['node'].link.queue),
+                       (from_node_id, len(self.network[from_node_id]['node'].tx_link.queue),
+                        to_node_id, len(self.network[to_node_id]['node'].rx_link.queue),
                         packet_size/1024))
-            self.network[from_node_id]['node'].link.release(req_from)
-            self.network[to_node_id]['node'].link.release(req_to)
+            self.network[from_node_id]['node'].tx_link.release(req_from)
+            self.network[to_node_id]['node'].rx_link.release(req_to)
             assert not req_timeout.processed
             return False
         assert req_to.processed and req_from.processed
 
-        the_bandwidth = min(self.network[from_node_id]['node'].bandwidth, self.network[to_node_id]['node'].bandwidth)
+        the_bandwidth = min(self.network[from_node_id]['node'].tx_bandwidth, self.network[to_node_id]['node'].rx_bandwidth)
         if throttle_bandwidth > 0:
             the_bandwidth = min(the_bandwidth, throttle_bandwidth)
         the_latency = float(packet_size) / the_bandwidth
         yield self.env.timeout(the_latency)
 
-        self.network[from_node_id]['node'].link.release(req_from)
-        self.network[to_node_id]['node'].link.release(req_to)
+        self.network[from_node_id]['node'].tx_link.release(req_from)
+        self.network[to_node_id]['node'].rx_link.release(req_to)
+        self.transferred_bytes += packet_size
+        self.record(eventlog.TRANSFER, from_node_id, to_node_id, packet_size, the_latency)
         self.debug("NETWORK\t%s:%s->%s:%s: %.1f KB in %4.2fms" %
-                   (from_node_id, len(self.network[from_node_id]['node'].link.queue),
-                    to_node_id, len(self.network[to_node_id]['node'].link.queue),
+                   (from_node_id, len(self.network[from_node_id]['node'].tx_link.queue),
+                    to_node_id, len(self.network[to_node_id]['node'].rx_link.queue),
                     packet_size/1024, the_latency*1000))
             
 
+#: CPU seconds a NameNode spends on one RPC, for an empty namespace
+RPC_CPU_COSTS = {
+    "heartbeat": 0.0001,
+    "block_report": 0.001,
+    "incremental_block_report": 0.0002,
+    "add_block": 0.0003,
+    "complete": 0.0002,
+}
+#: CPU seconds a NameNode spends on every block in a block report
+BLOCK_REPORT_CPU_COST_PER_BLOCK = 0.000002
+#: RPCs taking the namesystem write lock, others take the read lock
+WRITE_LOCKED_RPCS = ("block_report", "incremental_block_report", "add_block", "complete")
+
+#: "random" places replicas on any datanodes, "rack-aware" follows BlockPlacementPolicyDefault
+BLOCK_PLACEMENT_POLICIES = ("random", "rack-aware")
+
+#: a block report with its blocks unknown, as if it listed about 50k blocks
+FIXED_BLOCK_REPORT_SIZE = 1234 * 1024
+BLOCK_REPORT_HEADER_SIZE = 1024
+#: block id, length and generation stamp
+BLOCK_REPORT_ENTRY_SIZE = 24
+#: blocks listed by a fixed-size block report
+FIXED_BLOCK_REPORT_BLOCKS = (FIXED_BLOCK_REPORT_SIZE - BLOCK_REPORT_HEADER_SIZE) // BLOCK_REPORT_ENTRY_SIZE
+
+
 class NameNode(Node):
-    def __init__(self, env, node_id, hdfs=None, **kwargs):
+    def __init__(self, env, node_id, hdfs=None, handler_count=10, rpc_costs=None, block_placement_policy="random",
+                 **kwargs):
+        """RPCs are served by handler_count handlers on cpu_cores cores, under one namesystem lock
+
+        rpc_costs overrides entries of RPC_CPU_COSTS.
+        """
         super(NameNode, self).__init__(env, node_id, **kwargs)
+        if block_placement_policy not in BLOCK_PLACEMENT_POLICIES:
+            raise SimulatorException("unknown block placement policy: %s" % block_placement_policy)
+        #: dfs.block.replicator.classname
+        self.block_placement_policy = block_placement_policy
+        #: dfs.namenode.handler.count
+        self.handler_count = handler_count
+        self.handlers = simpy.Resource(self.env, capacity=handler_count)
+        self.cpu = simpy.Resource(self.env, capacity=self.cpu_cores)
+        #: readers take one token, a writer takes all of them; waiting writers block later readers
+        self.namesystem_lock = simpy.Container(self.env, init=handler_count, capacity=handler_count)
+        self.rpc_costs = dict(RPC_CPU_COSTS)
+        self.rpc_costs.update(rpc_costs or {})
+        #: rpc -> {"count": served RPCs, "wait": seconds queued, "service": CPU seconds}
+        self.rpc_stats = {}
+        self.cpu_busy_time = 0
         #: store files' placement
         self.metadata = {}
+        self.file_sizes = {}
+        #: file name -> erasure coding policy name, files not in it are replicated
+        self.erasure_coding = {}
+        #: striped file name -> {datanode: bytes of its internal block}, without the datanodes storing no cell
+        self.internal_block_sizes = {}
         self.datanodes = {}
         self.hdfs = hdfs
 
@@ -365,11 +670,88 @@ class NameNode(Node):
     def query_file(self, file_name):
         return self.metadata.get(file_name)
 
+    def get_rpc_cost(self, rpc, blocks=0):
+        """CPU seconds of an RPC: it grows with the log of the namespace size and with the reported blocks"""
+        namespace_factor = 1 + math.log(1 + len(self.metadata), 2) / 20
+        return self.rpc_costs[rpc] * namespace_factor + blocks * BLOCK_REPORT_CPU_COST_PER_BLOCK
+
+    def process_rpc(self, rpc, blocks=0):
+        return self.env.process(self._process_rpc(rpc, blocks))
+
+    def _process_rpc(self, rpc, blocks=0):
+        arrival_time = self.env.now
+        lock_tokens = self.handler_count if rpc in WRITE_LOCKED_RPCS else 1
+        with self.handlers.request() as handler:
+            yield handler
+            yield self.namesystem_lock.get(lock_tokens)
+            with self.cpu.request() as core:
+                yield core
+                service_time = self.get_rpc_cost(rpc, blocks)
+                yield self.env.timeout(service_time)
+            yield self.namesystem_lock.put(lock_tokens)
+        stats = self.rpc_stats.setdefault(rpc, {"count": 0, "wait": 0, "service": 0})
+        stats["count"] += 1
+        stats["wait"] += self.env.now - arrival_time - service_time
+        stats["service"] += service_time
+        self.cpu_busy_time += service_time
+        self.debug("RPC\t%s\t%i blocks\t%4.2fms" % (rpc, blocks, service_time*1000))
+
+    def get_cpu_utilization(self):
+        return float(self.cpu_busy_time) / (self.cpu_cores * self.env.now) if self.env.now > 0 else 0
+
     def find_datanodes_for_new_file(self, file_name, size, replica_number):
-        return random.sample(self.datanodes.keys(), min(replica_number, len(self.datanodes)))
+        datanode_names = sorted(self.datanodes.keys())
+        replica_number = min(replica_number, len(datanode_names))
+        if self.block_placement_policy == "random":
+            return self.random_stream.sample(datanode_names, replica_number)
+        # the client is off the cluster: the first replica goes anywhere, the second on another rack,
+        # the third on the rack of the second, and the others anywhere
+        chosen = []
+        while len(chosen) < replica_number:
+            remaining = [n for n in datanode_names if n not in chosen]
+            if len(chosen) == 1:
+                preferred = [n for n in remaining if self.datanodes[n].rack != self.datanodes[chosen[0]].rack]
+            elif len(chosen) == 2:
+                preferred = [n for n in remaining if self.datanodes[n].rack == self.datanodes[chosen[1]].rack]
+            else:
+                preferred = remaining
+            chosen.append(self.random_stream.choice(preferred or remaining))
+        return chosen
 
-    def register_file(self, file_name, datanode_names):
+    def register_file(self, file_name, datanode_names, size=0, erasure_coding_policy=None, internal_block_sizes=None):
         self.metadata[file_name] = datanode_names
+        self.file_sizes[file_name] = size
+        if erasure_coding_policy:
+            self.erasure_coding[file_name] = erasure_coding_policy
+            self.internal_block_sizes[file_name] = dict(internal_block_sizes or {})
+        else:
+            self.erasure_coding.pop(file_name, None)
+            self.internal_block_sizes.pop(file_name, None)
+
+    def get_replica_size(self, file_name, node_id):
+        """Bytes node_id stores for the file: a whole replica, or its internal block of a striped file"""
+        if file_name in self.erasure_coding:
+            return self.internal_block_sizes[file_name].get(node_id, 0)
+        return self.file_sizes.get(file_name, 0)
+
+    def get_datanode_blocks(self, node_id):
+        """Files node_id stores a replica of, or a non-empty internal block of"""
+        return [f for f, datanode_names in self.metadata.items() if node_id in datanode_names
+                and (f not in self.erasure_coding or node_id in self.internal_block_sizes[f])]
+
+    def get_datanode_used(self, node_id):
+        return sum([self.get_replica_size(f, node_id) for f in self.get_datanode_blocks(node_id)])
+
+    def get_datanode_utilization(self, node_id):
+        """Percentage of the datanode disk occupied by its blocks"""
+        return 100.0 * self.get_datanode_used(node_id) / self.datanodes[node_id].disk
+
+    def move_replica(self, file_name, from_node_id, to_node_id):
+        datanode_names = self.metadata[file_name]
+        datanode_names[datanode_names.index(from_node_id)] = to_node_id
+        sizes = self.internal_block_sizes.get(file_name, {})
+        if from_node_id in sizes:
+            sizes[to_node_id] = sizes.pop(from_node_id)
 
         
 class DataNode(Node):
@@ -377,24 +759,97 @@ class DataNode(Node):
         super(DataNode, self).__init__(env, node_id, **kwargs)
         self.hdfs = hdfs
         self.doing_block_report = False
+        self.doing_incremental_block_report = False
+        self.doing_heartbeat = False
+        #: block name -> size of the replica or internal block stored here
+        self.blocks = {}
+        #: blocks received or deleted since the last incremental block report
+        self.pending_block_changes = []
+        self.blocks_changed = self.env.event()
+        self.block_report_bytes = 0
+        self.incremental_block_report_bytes = 0
+
+    def receive_block(self, block_name, size):
+        self.blocks[block_name] = size
+        self.add_block_change(block_name)
+
+    def delete_block(self, block_name):
+        if self.blocks.pop(block_name, None) is not None:
+            self.add_block_change(block_name)
+
+    def add_block_change(self, block_name):
+        # only incremental block reports send changes, nothing would ever drain them otherwise
+        if not (self.hdfs.enable_block_report and self.hdfs.enable_incremental_block_report):
+            return
+        self.pending_block_changes.append(block_name)
+        if not self.blocks_changed.triggered:
+            self.blocks_changed.succeed()
+
+    def _break_disk(self, delay=0):
+        """A broken disk loses every block it stored, so its later block reports list none"""
+        yield from super(DataNode, self)._break_disk(delay)
+        self.blocks = {}
 
     def get_block_report(self):
-        #: TODO: I am assuming block report is a static value, not generated according to the stored blocks
-        block_report_size = 1234 * 1024
-        return block_report_size
+        """Full block report size: listing the stored blocks, or fixed without incremental block reports"""
+        if not self.hdfs.enable_incremental_block_report:
+            return FIXED_BLOCK_REPORT_SIZE
+        return BLOCK_REPORT_HEADER_SIZE + BLOCK_REPORT_ENTRY_SIZE * len(self.blocks)
+
+    def start_heartbeat(self, interval, heartbeat_size):
+        if not self.doing_heartbeat:
+            # set before the loop runs, so a second start in the meantime spawns no other loop
+            self.doing_heartbeat = True
+            self.env.process(self._start_heartbeat(interval, heartbeat_size))
+
+    def _start_heartbeat(self, interval, heartbeat_size):
+        self.info("start heartbeat every %ss" % interval)
+        while self.doing_heartbeat:
+            yield self.hdfs.switch.process_ping(self.id, self.hdfs.namenode.id, heartbeat_size)
+            yield self.hdfs.namenode.process_rpc("heartbeat")
+            yield self.env.timeout(interval)
+        self.info("end heartbeat")
 
     def start_block_report(self, interval):
-        self.env.process(self._start_block_report(interval))
+        if not self.doing_block_report:
+            self.doing_block_report = True
+            self.env.process(self._start_block_report(interval))
 
     def _start_block_report(self, interval):
-        self.doing_block_report = True
         self.info("start block report every %is" % interval)
         while self.doing_block_report:
             report_size = self.get_block_report()
             yield self.hdfs.switch.process_ping(self.id, self.hdfs.namenode.id, report_size)
+            self.block_report_bytes += report_size
+            # the NameNode processes as many blocks as the report lists
+            if self.hdfs.enable_incremental_block_report:
+                blocks = len(self.blocks)
+            else:
+                blocks = FIXED_BLOCK_REPORT_BLOCKS
+            yield self.hdfs.namenode.process_rpc("block_report", blocks)
             yield self.env.timeout(interval)
         self.info("end block report")
 
+    def start_incremental_block_report(self, interval=0):
+        if not self.doing_incremental_block_report:
+            self.doing_incremental_block_report = True
+            self.env.process(self._start_incremental_block_report(interval))
+
+    def _start_incremental_block_report(self, interval=0):
+        """Report received and deleted blocks once they change, batching the changes of interval seconds"""
+        self.info("start incremental block report")
+        while self.doing_incremental_block_report:
+            yield self.blocks_changed
+            if interval > 0:
+                yield self.env.timeout(interval)
+            changes, self.pending_block_changes = self.pending_block_changes, []
+            self.blocks_changed = self.env.event()
+            report_size = BLOCK_REPORT_HEADER_SIZE + BLOCK_REPORT_ENTRY_SIZE * len(changes)
+            yield self.hdfs.switch.process_ping(self.id, self.hdfs.namenode.id, report_size)
+            self.incremental_block_report_bytes += report_size
+            yield self.hdfs.namenode.process_rpc("incremental_block_report", len(changes))
+        self.info("end incremental block report")
+
 
 def main():
     """Main function only in command line"""
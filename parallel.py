@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Conservative parallel discrete event simulation of HDFS writes, partitioned by rack
+Attributes:
+
+Datanodes are split into partitions by rack, every partition owns a simpy Environment and may run in
+its own process. Partitions write files with the pipeline of HDFS (pipeline.WritePipeline) but their
+own transport: a transfer is cut-through, the sender holds its transmit channel while it transmits,
+and the packet reaches the receive channel one switch latency later as a timestamped message.
+Messages for another partition are exchanged at barriers. A node only starts sending when one of its
+transmissions or receptions ends or a disk write completes, so every partition knows the earliest
+time a message it sends could arrive, and a window lasts until the earliest such time of all
+partitions: a message sent in a window always arrives in a later one.
+
+Every node draws from its own random stream and messages arriving together are received in
+(arrival, sender, sequence) order, so the result for a seed is the same however racks are split into
+partitions, and whether partitions run in one process or in many.
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+import heapq
+import math
+import multiprocessing
+import time
+
+import simpy
+
+import node
+import pipeline
+
+
+class Partition(pipeline.WritePipeline):
+    """A group of racks simulated by its own Environment, writing with the pipeline of HDFS"""
+
+    def __init__(self, index, node_ids, owners, seed=0, default_bandwidth=100*1024*1024/8,
+                 default_disk_speed=80*1024*1024, latency=0.001, enable_datanode_cache=True, **kwargs):
+        super(Partition, self).__init__(seed=seed, **kwargs)
+
+        self.env = simpy.Environment()
+        self.index = index
+        self.id = "partition%i" % index
+        #: node id -> index of the partition owning it
+        self.owners = owners
+        self.latency = latency
+        self.enable_datanode_cache = enable_datanode_cache
+
+        self.nodes = {}
+        for node_id in node_ids:
+            self.nodes[node_id] = node.Node(self.env, node_id, disk_speed=default_disk_speed,
+                                            default_bandwidth=default_bandwidth, do_info=self.do_info,
+                                            do_warning=self.do_warning, do_debug=self.do_debug,
+                                            do_critical=self.do_critical, seed=seed)
+
+        self.outbox = []
+        #: node id -> messages it sent
+        self.sequences = {}
+        #: heap of delivered messages which have not arrived yet
+        self.arrivals = []
+        self.transferred_bytes = 0
+        self.finished_files = {}
+        #: node id -> end of its current transmission
+        self.transmitting = {}
+        #: (sender, sequence) -> (receiver, earliest start, duration, started) of a reception
+        self.receiving = {}
+        self.pending_writes = 0
+        #: end of the current window: every message sent in it arrives no earlier
+        self.window_end = 0
+
+    def step(self, window_end, messages, files=()):
+        """Deliver messages, start files, then simulate the events before window_end
+
+        Returns:
+            (messages for other partitions, earliest output time, time of the next local event or
+            arrival, files finished meanwhile)
+        """
+        self.window_end = window_end
+        for message in messages:
+            self.deliver(message)
+        for file_name, size, pipeline_nodes in files:
+            self.env.process(self._put_file(file_name, size, pipeline_nodes))
+        self.advance(window_end)
+
+        outbox, self.outbox = self.outbox, []
+        finished_files, self.finished_files = self.finished_files, {}
+        next_event_time = min([self.env.peek()] + [m[0] for m in self.arrivals[:1]])
+        return outbox, self.get_earliest_output_time(window_end), next_event_time, finished_files
+
+    def advance(self, window_end):
+        """Process the events before window_end, receiving every message before the events of its arrival time
+
+        Messages sent in a window arrive in a later one, so the arrivals before window_end are all
+        delivered already. Environment.run stops at an arrival time before the events of that time,
+        and the receptions started then run first as they start urgently.
+        """
+        while self.arrivals and self.arrivals[0][0] < window_end:
+            if self.arrivals[0][0] > self.env.now:
+                # run() leaves its spent stop event queued, the next event processed is that no-op
+                self.env.run(until=self.arrivals[0][0])
+            while self.arrivals and self.arrivals[0][0] <= self.env.now:
+                self.env.process(self._receive(heapq.heappop(self.arrivals)))
+        while self.env.peek() < window_end:
+            self.env.step()
+
+    def get_earliest_output_time(self, now):
+        """Lower bound of the arrival time of a message sent after now, before this partition receives another one"""
+        triggers = list(self.transmitting.values())
+        # a queued reception starts once the current one on its receive channel ends
+        receive_ends = dict([(node_id, start + duration)
+                             for node_id, start, duration, started in self.receiving.values() if started])
+        for node_id, start, duration, started in self.receiving.values():
+            if started:
+                triggers.append(start + duration)
+            else:
+                triggers.append(max(start, now, receive_ends.get(node_id, now)) + duration)
+        if self.pending_writes:
+            triggers.append(self.env.peek())
+        return max(min(triggers), now) + self.latency if triggers else float("inf")
+
+    def post(self, arrival_time, from_node_id, to_node_id, size, kind, payload):
+        assert arrival_time >= self.window_end, "a message must arrive after the window it is sent in"
+        sequence = self.sequences.get(from_node_id, 0)
+        self.sequences[from_node_id] = sequence + 1
+        message = (arrival_time, from_node_id, sequence, to_node_id, size, kind, payload)
+        if self.owners[to_node_id] == self.index:
+            self.deliver(message)
+        else:
+            self.outbox.append(message)
+
+    def deliver(self, message):
+        """Queue a message until it reaches its receiver at its arrival time
+
+        Messages arriving together take the receive channels in (arrival, sender, sequence) order,
+        whichever partition sent them and whenever they were delivered.
+        """
+        arrival_time, from_node_id, sequence, to_node_id, size = message[:5]
+        receive_time = float(size) / self.nodes[to_node_id].rx_bandwidth
+        self.receiving[(from_node_id, sequence)] = (to_node_id, arrival_time, receive_time, False)
+        heapq.heappush(self.arrivals, message)
+
+    def transmit(self, from_node_id, to_node_id, size, packet, is_ack=False):
+        return self.env.process(self._send(from_node_id, to_node_id, size, "ack" if is_ack else "packet", packet))
+
+    def _send(self, from_node_id, to_node_id, size, kind, payload):
+        """Cut-through: the sender holds its transmit channel while the packet reaches the receiver"""
+        sender = self.nodes[from_node_id]
+        with sender.tx_link.request() as req:
+            yield req
+            # the head of the packet reaches the receiver one switch latency later
+            self.post(self.env.now + self.latency, from_node_id, to_node_id, size, kind, payload)
+            transmit_time = float(size) / sender.tx_bandwidth
+            self.transmitting[from_node_id] = self.env.now + transmit_time
+            yield self.env.timeout(transmit_time)
+            self.transmitting.pop(from_node_id)
+        self.transferred_bytes += size
+
+    def _receive(self, message):
+        arrival_time, from_node_id, sequence, to_node_id, size, kind, payload = message
+        receiver = self.nodes[to_node_id]
+        receive_time = float(size) / receiver.rx_bandwidth
+        with receiver.rx_link.request() as req:
+            yield req
+            self.receiving[(from_node_id, sequence)] = (to_node_id, self.env.now, receive_time, True)
+            yield self.env.timeout(receive_time)
+        self.receiving.pop((from_node_id, sequence))
+        if kind == "packet":
+            self.receive_packet(payload)
+        else:
+            self.receive_ack(payload)
+
+    def store_data(self, node_id, size, stream=None):
+        if self.enable_datanode_cache:
+            written = self.nodes[node_id].new_disk_buffer_write_request(size)
+        else:
+            written = self.nodes[node_id].new_disk_write_request(size)
+        self.pending_writes += 1
+        written.callbacks.append(self._finish_write)
+        return written
+
+    def _finish_write(self, event):
+        self.pending_writes -= 1
+
+    def _put_file(self, file_name, size, pipeline_nodes):
+        yield self.write_packets(file_name, size, pipeline_nodes)
+        self.finished_files[file_name] = self.env.now
+        self.info("ALL ACKs collected, put_file %s finished" % file_name)
+
+
+def _serve_partition(connection, partition_kwargs):
+    """Run one partition in a worker process, window by window"""
+    partition = Partition(**partition_kwargs)
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        connection.send(partition.step(*command))
+    connection.close()
+
+
+class LocalPartition(object):
+    """Drive a partition in this process with the same interface as a worker process"""
+
+    def __init__(self, partition_kwargs):
+        self.partition = Partition(**partition_kwargs)
+        self.reply = None
+        #: wall seconds of the last step
+        self.step_time = 0
+
+    def send(self, command):
+        start = time.time()
+        self.reply = self.partition.step(*command) if command is not None else None
+        self.step_time = time.time() - start
+
+    def recv(self):
+        return self.reply
+
+    def close(self):
+        pass
+
+
+class RemotePartition(object):
+    def __init__(self, partition_kwargs):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve_partition, args=(child_connection, partition_kwargs))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+
+    def send(self, command):
+        self.connection.send(command)
+
+    def recv(self):
+        return self.connection.recv()
+
+    def close(self):
+        self.connection.send(None)
+        self.process.join()
+        self.connection.close()
+
+
+class ParallelHDFS(object):
+    """Write files into an HDFS whose racks are simulated by parallel partitions
+
+    Datanode i and client i are on rack i % number_of_racks, rack r belongs to partition
+    r % number_of_partitions, and client i % number_of_clients writes file i.
+
+    Packets and acks follow the pipeline of HDFS.put_files, but the Switch of HDFS holds the links
+    of both ends at once, which no partition could do alone, so transfers are cut-through here. There
+    is no NameNode either: no add_block or complete RPCs, heartbeats or block reports. Runs with any
+    partitioning agree for a seed.
+    """
+
+    def __init__(self, number_of_datanodes=20, number_of_racks=4, number_of_partitions=None, in_process=False,
+                 seed=0, replica_number=3, latency=0.001, number_of_clients=1, **kwargs):
+        self.id = "ParallelHDFS"
+        self.now = 0.0
+        self.number_of_partitions = number_of_partitions or number_of_racks
+        self.in_process = in_process
+        self.seed = seed
+        self.replica_number = replica_number
+        #: a message never arrives earlier than one switch latency after it is sent
+        self.lookahead = latency
+        self.partition_kwargs = dict(kwargs, seed=seed, latency=latency)
+        self.partition_kwargs.setdefault("do_info", False)
+        self.partition_kwargs.setdefault("do_warning", False)
+        self.partition_kwargs.setdefault("do_critical", False)
+
+        self.datanode_ids = ["datanode%i" % i for i in range(number_of_datanodes)]
+        self.client_ids = ["client%i" % i for i in range(number_of_clients)]
+        self.owners = {}
+        for node_ids in (self.datanode_ids, self.client_ids):
+            for i, node_id in enumerate(node_ids):
+                self.owners[node_id] = (i % number_of_racks) % self.number_of_partitions
+        self.windows = 0
+        self.messages = 0
+        #: with in_process, wall seconds of the slowest partition summed over windows: the run time
+        #: if every partition had a core of its own and synchronizing were free
+        self.critical_path_time = 0
+
+    def create_partitions(self):
+        partitions = []
+        for index in range(self.number_of_partitions):
+            node_ids = sorted([n for n, owner in self.owners.items() if owner == index])
+            partition_kwargs = dict(self.partition_kwargs, index=index, node_ids=node_ids, owners=self.owners)
+            if self.in_process:
+                partitions.append(LocalPartition(partition_kwargs))
+            else:
+                partitions.append(RemotePartition(partition_kwargs))
+        return partitions
+
+    def put_files(self, num, size):
+        """Return the simulated time when all files are acked"""
+        placement = node.get_random_stream(self.seed, "placement")
+        files = []
+        for i in range(num):
+            pipeline = [self.client_ids[i % len(self.client_ids)]] + placement.sample(self.datanode_ids, min(self.replica_number, len(self.datanode_ids)))
+            files.append(("hello.%i.txt" % i, size, pipeline))
+
+        partitions = self.create_partitions()
+        try:
+            self.now = self.synchronize(partitions, files)
+        finally:
+            for partition in partitions:
+                partition.close()
+        return self.now
+
+    def synchronize(self, partitions, files):
+        inboxes = [[] for p in partitions]
+        new_files = [[] for p in partitions]
+        for f in files:
+            new_files[self.owners[f[2][0]]].append(f)
+        # clients start sending in the first window
+        output_times = [self.now + self.lookahead] * len(partitions)
+        next_event_times = [self.now] * len(partitions)
+        finished_files = {}
+        while len(finished_files) < len(files):
+            # a delivered message triggers sends no earlier than its arrival
+            window_end = min(output_times + [m[0] + self.lookahead for inbox in inboxes for m in inbox])
+            # a partition without messages, files or events in the window keeps its state
+            active = [index for index in range(len(partitions))
+                      if inboxes[index] or new_files[index] or next_event_times[index] < window_end]
+            for index in active:
+                messages = sorted(inboxes[index], key=lambda m: m[:3])
+                partitions[index].send((window_end, messages, new_files[index]))
+                inboxes[index] = []
+                new_files[index] = []
+            if self.in_process:
+                self.critical_path_time += max([partitions[index].step_time for index in active] or [0])
+            for index in active:
+                outbox, output_times[index], next_event_times[index], finished = partitions[index].recv()
+                finished_files.update(finished)
+                for message in outbox:
+                    inboxes[self.owners[message[3]]].append(message)
+                    self.messages += 1
+            self.windows += 1
+        return max(finished_files.values()) if finished_files else self.now
+
+
+def main():
+    """Main function only in command line: compare one partition with parallel partitions"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the parallel simulation of client writes.')
+    parser.add_argument('--nodes', type=int, default=400, help='number of datanodes')
+    parser.add_argument('--racks', type=int, default=4, help='number of racks')
+    parser.add_argument('--clients', type=int, default=40, help='number of clients')
+    parser.add_argument('--files', type=int, default=400, help='number of generate files')
+    parser.add_argument('--size', type=int, default=16*1024*1024, help='file size')
+    args = parser.parse_args()
+
+    print("Partitions\tProcesses\tSimulatedTime\tWindows\tMessages\tExecutionTime\tCriticalPath\tSpeedup")
+    sequential_time = None
+    for partitions, in_process in ((1, True), (args.racks, True), (args.racks, False)):
+        the_hdfs = ParallelHDFS(number_of_datanodes=args.nodes, number_of_racks=args.racks,
+                                number_of_partitions=partitions, in_process=in_process,
+                                number_of_clients=args.clients, seed=1)
+        start = time.time()
+        t = the_hdfs.put_files(args.files, args.size)
+        execution_time = time.time() - start
+        sequential_time = sequential_time or execution_time
+        # measured against one partition; in one process it stays below 1, partitions take turns
+        print("%i\t%s\t%.6f\t%i\t%i\t%.3f\t%s\t%.2f" % (partitions, not in_process, t, the_hdfs.windows,
+                                                     the_hdfs.messages, execution_time,
+                                                     "%.3f" % the_hdfs.critical_path_time if in_process else "-",
+                                                     sequential_time / execution_time))
+    print("%i CPUs" % multiprocessing.cpu_count())
+
+if __name__ == '__main__':
+    main()
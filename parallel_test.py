@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Brief Summary
+Attributes:
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+
+import unittest
+
+import parallel
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_processes_match_sequential(self):
+        sequential = parallel.ParallelHDFS(number_of_datanodes=8, number_of_racks=2, in_process=True, seed=1)
+        t = sequential.put_files(4, 4*1024*1024)
+        self.assertGreater(sequential.messages, 0)
+
+        processes = parallel.ParallelHDFS(number_of_datanodes=8, number_of_racks=2, in_process=False, seed=1)
+        self.assertEqual(processes.put_files(4, 4*1024*1024), t)
+        self.assertEqual(processes.messages, sequential.messages)
+
+    def test_single_partition(self):
+        single = parallel.ParallelHDFS(number_of_datanodes=8, number_of_racks=2, number_of_partitions=1,
+                                       in_process=True, seed=1)
+        self.assertGreater(single.put_files(4, 4*1024*1024), 0)
+        self.assertEqual(single.messages, 0)
+
+    def test_clients_match_sequential(self):
+        kwargs = dict(number_of_datanodes=12, number_of_racks=3, number_of_clients=6, in_process=True, seed=1)
+        sequential = parallel.ParallelHDFS(number_of_partitions=1, **kwargs)
+        t = sequential.put_files(12, 4*1024*1024)
+        partitioned = parallel.ParallelHDFS(**kwargs)
+        self.assertEqual(partitioned.put_files(12, 4*1024*1024), t)
+        self.assertGreater(partitioned.messages, 0)
+        # windows end at the earliest output time, not every switch latency
+        self.assertLess(partitioned.windows, t / 0.001 / 10)
+
+
+    def test_write_window(self):
+        kwargs = dict(number_of_datanodes=8, number_of_racks=2, in_process=True, seed=1)
+        t = parallel.ParallelHDFS(**kwargs).put_files(2, 8*1024*1024)
+        stop_and_wait = parallel.ParallelHDFS(max_packets_in_flight=1, **kwargs)
+        self.assertGreater(stop_and_wait.put_files(2, 8*1024*1024), t)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Pipelined block writes, shared by HDFS and the partitions of parallel.ParallelHDFS
+Attributes:
+
+The client keeps at most max_packets_in_flight packets unacknowledged. Every datanode of the pipeline
+forwards a packet downstream as soon as it is received, writes it locally at the same time, and acks
+upstream after both its local write and the downstream ack are done. One stage per hop sends the
+packets of a file from a node to the next in order.
+
+A subclass moves packets and acks between nodes: its transmit sends one, and the receiving side calls
+receive_packet or receive_ack once it arrives.
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+import math
+
+import simpy
+
+import node
+
+
+class WritePipeline(node.BaseSim):
+    """The client and datanode sides of a pipelined write, over the transport of a subclass"""
+
+    def __init__(self, client_write_packet_size=1024*1024, max_bytes_in_flight=80*64*1024,
+                 max_packets_in_flight=None, ack_size=64, **kwargs):
+        super(WritePipeline, self).__init__(**kwargs)
+
+        self.client_write_packet_size = client_write_packet_size
+        #: dfs.client.write.max-packets times the 64 KB dfs.client-write-packet-size: bytes sent by the client
+        #: but not yet acked by the pipeline
+        self.max_bytes_in_flight = max_bytes_in_flight
+        #: packets sent but not yet acked, None for as many as fit in max_bytes_in_flight
+        if max_packets_in_flight is None:
+            max_packets_in_flight = max(1, max_bytes_in_flight // client_write_packet_size)
+        self.max_packets_in_flight = max_packets_in_flight
+        #: size of one pipeline ack sent upstream
+        self.ack_size = ack_size
+
+        #: (file name, hop) -> packets waiting to be sent from pipeline[hop] to pipeline[hop+1]
+        self.hops = {}
+        #: (file name, packet seqno, hop) -> event succeeding when pipeline[hop] gets the downstream ack
+        self.acks = {}
+        #: file name -> in-flight window of the client writing it
+        self.windows = {}
+        self.unacked_packets = {}
+        self.file_done = {}
+
+    def transmit(self, from_node_id, to_node_id, size, packet, is_ack=False):
+        """Send a packet or its ack, return an event succeeding when from_node_id may send the next one"""
+        raise NotImplementedError
+
+    def store_data(self, node_id, size, stream=None):
+        raise NotImplementedError
+
+    def write_packets(self, file_name, size, pipeline, throttle_bandwidth=-1):
+        return self.env.process(self._write_packets(file_name, size, pipeline, throttle_bandwidth))
+
+    def _write_packets(self, file_name, size, pipeline, throttle_bandwidth=-1):
+        """Send the file from pipeline[0] packet by packet, until every packet is acked"""
+        number_of_packets = int(math.ceil(float(size) / self.client_write_packet_size))
+        if len(pipeline) < 2 or number_of_packets == 0:
+            return
+        window = simpy.Container(self.env, init=self.max_packets_in_flight, capacity=self.max_packets_in_flight)
+        self.windows[file_name] = window
+        self.unacked_packets[file_name] = number_of_packets
+        done = self.file_done[file_name] = self.env.event()
+        for seqno in range(number_of_packets):
+            # wait until there is room in the in-flight window
+            yield window.get(1)
+            packet = {
+                "name": "%s.%i" % (file_name, seqno + 1),
+                "file": file_name,
+                "seqno": seqno,
+                "size": min(self.client_write_packet_size, size - seqno * self.client_write_packet_size),
+                "pipeline": pipeline,
+                #: the packet goes from pipeline[hop] to pipeline[hop+1]
+                "hop": 0,
+                "last": seqno + 1 == number_of_packets,
+                "throttle_bandwidth": throttle_bandwidth,
+            }
+            yield self.get_hop(packet).put(packet)
+        yield done
+
+    def get_hop(self, packet):
+        """Queue of the hop of the packet, whose stage starts with its first packet"""
+        key = (packet["file"], packet["hop"])
+        if key not in self.hops:
+            # a datanode buffers no more packets than the client may have in flight
+            self.hops[key] = simpy.Store(self.env, capacity=self.max_packets_in_flight)
+            self.env.process(self._pipeline_stage(key))
+        return self.hops[key]
+
+    def _pipeline_stage(self, key):
+        """Send the packets of one hop in order, until the last one"""
+        while True:
+            packet = yield self.hops[key].get()
+            pipeline, hop = packet["pipeline"], packet["hop"]
+            yield self.transmit(pipeline[hop], pipeline[hop+1], packet["size"], packet)
+            if packet["last"]:
+                break
+        self.hops.pop(key)
+
+    def receive_packet(self, packet):
+        """pipeline[hop+1] got the packet: store and ack it, and queue it for the next hop if any
+
+        Returns:
+            an event succeeding once the packet is queued downstream
+        """
+        pipeline, hop = packet["pipeline"], packet["hop"]
+        self.debug("PIPELINE_RECEIVED\t%s\t%s->%s" % (packet["name"], pipeline[hop], pipeline[hop+1]))
+        self.env.process(self._respond_packet(packet))
+        if hop + 2 == len(pipeline):
+            return self.env.timeout(0)
+        downstream_packet = dict(packet, hop=hop+1)
+        return self.get_hop(downstream_packet).put(downstream_packet)
+
+    def _respond_packet(self, packet):
+        """Ack a packet upstream once it is stored locally and acked by the downstream datanode"""
+        pipeline, hop = packet["pipeline"], packet["hop"]
+        written = self.store_data(pipeline[hop+1], packet["size"], packet["file"])
+        if hop + 2 < len(pipeline):
+            yield written & self.get_ack(packet["file"], packet["seqno"], hop+1)
+            self.acks.pop((packet["file"], packet["seqno"], hop+1))
+        else:
+            yield written
+        yield self.transmit(pipeline[hop+1], pipeline[hop], self.ack_size, packet, is_ack=True)
+
+    def get_ack(self, file_name, seqno, hop):
+        key = (file_name, seqno, hop)
+        if key not in self.acks:
+            self.acks[key] = self.env.event()
+        return self.acks[key]
+
+    def receive_ack(self, packet):
+        """pipeline[hop] got the ack of pipeline[hop+1]: a datanode may ack upstream, the client sends on"""
+        file_name, hop = packet["file"], packet["hop"]
+        if hop > 0:
+            self.get_ack(file_name, packet["seqno"], hop).succeed()
+            return
+        self.debug("PIPELINE_ACKED\t%s" % packet["name"])
+        self.windows[file_name].put(1)
+        self.unacked_packets[file_name] -= 1
+        if self.unacked_packets[file_name] == 0:
+            self.unacked_packets.pop(file_name)
+            self.windows.pop(file_name)
+            self.file_done.pop(file_name).succeed()
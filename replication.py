@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Independent replications of a simulation, run in parallel until a confidence interval is narrow enough
+Attributes:
+
+Replication i runs with seed base_seed + i. Every component draws from its own stream seeded by the
+replication seed and its id, so two configurations run with the same seed share common random
+numbers, and comparing them replication by replication cancels most of the noise.
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+import math
+import multiprocessing
+import statistics
+
+import hdfs
+import node
+
+
+def t_quantile(p, degrees_of_freedom):
+    """Quantile of the Student t distribution, by the Cornish-Fisher expansion of the normal quantile
+
+    Its error is below 1% from 3 degrees of freedom on, which is plenty for a stopping rule.
+    """
+    z = statistics.NormalDist().inv_cdf(p)
+    n = float(degrees_of_freedom)
+    g1 = (z**3 + z) / 4
+    g2 = (5*z**5 + 16*z**3 + 3*z) / 96
+    g3 = (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / 384
+    g4 = (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / 92160
+    return z + g1 / n + g2 / n**2 + g3 / n**3 + g4 / n**4
+
+
+def confidence_interval(samples, confidence=0.95):
+    """Return (mean, half width) of the confidence interval of the mean"""
+    mean = statistics.mean(samples)
+    if len(samples) < 2:
+        return mean, float("inf")
+    standard_error = statistics.stdev(samples) / math.sqrt(len(samples))
+    return mean, t_quantile(0.5 + confidence / 2, len(samples) - 1) * standard_error
+
+
+class HDFSExperiment(object):
+    """create_silent_hdfs(seed=seed, **config).operation(*args), callable with a seed in a worker process"""
+
+    def __init__(self, operation, args=(), **config):
+        self.operation = operation
+        self.args = tuple(args)
+        self.config = config
+
+    def __call__(self, seed):
+        the_hdfs = hdfs.create_silent_hdfs(seed=seed, **self.config)
+        return getattr(the_hdfs, self.operation)(*self.args)
+
+
+class PairedExperiment(object):
+    """The difference of two experiments run with the same seed"""
+
+    def __init__(self, experiment_a, experiment_b):
+        self.experiment_a = experiment_a
+        self.experiment_b = experiment_b
+
+    def __call__(self, seed):
+        return self.experiment_a(seed) - self.experiment_b(seed)
+
+
+def run_replications(experiment, target_width, confidence=0.95, min_replications=3, max_replications=100,
+                     processes=None, base_seed=0):
+    """Run replications in batches of processes until the confidence interval is narrower than target_width
+
+    Args:
+        experiment: a picklable callable from a seed to a number
+        target_width: stop once the full width of the interval is below it
+        processes: number of worker processes, None for one per CPU and 1 to run in this process
+
+    Returns:
+        {"mean", "half_width", "replications", "samples"}
+    """
+    if max_replications < 1:
+        raise node.SimulatorException("max_replications must be at least 1, got %i" % max_replications)
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    samples = []
+    try:
+        while len(samples) < max_replications:
+            batch = max(processes, min_replications - len(samples))
+            seeds = range(base_seed + len(samples), base_seed + min(len(samples) + batch, max_replications))
+            samples.extend(pool.map(experiment, seeds) if pool else [experiment(seed) for seed in seeds])
+            mean, half_width = confidence_interval(samples, confidence)
+            if len(samples) >= min_replications and 2 * half_width < target_width:
+                break
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return {"mean": mean, "half_width": half_width, "replications": len(samples), "samples": samples}
+
+
+def compare(experiment_a, experiment_b, target_width, **kwargs):
+    """Estimate experiment_a - experiment_b with common random numbers
+
+    Both experiments of a replication run with the same seed, so the interval is on the paired
+    differences, which are far less noisy than two independent estimates.
+    """
+    return run_replications(PairedExperiment(experiment_a, experiment_b), target_width, **kwargs)
+
+
+def main():
+    """Main function only in command line"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Replicate a put_files run until its confidence interval is narrow.')
+    parser.add_argument('--nodes', type=int, default=20, help='number of datanodes')
+    parser.add_argument('--files', type=int, default=30, help='number of generate files')
+    parser.add_argument('--width', type=float, default=1.0, help='target width of the confidence interval (s)')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    experiment = HDFSExperiment("put_files", (args.files, 64*1024*1024), number_of_datanodes=args.nodes)
+    result = run_replications(experiment, args.width, processes=args.processes)
+    print("put_files: %.3f +- %.3f s after %i replications" % (result["mean"], result["half_width"],
+                                                               result["replications"]))
+
+
+if __name__ == '__main__':
+    main()
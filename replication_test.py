@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Brief Summary
+Attributes:
+
+Google Python Style Guide:
+    http://google-styleguide.googlecode.com/svn/trunk/pyguide.html
+"""
+__copyright__ = "Zhaoyu Luo"
+
+
+import unittest
+
+import node
+import replication
+
+
+class TestReplication(unittest.TestCase):
+    def setUp(self):
+        self.experiment = replication.HDFSExperiment("put_files", (3, 8*1024*1024), number_of_datanodes=5,
+                                                     enable_heartbeats=False)
+
+    def test_seed_is_reproducible(self):
+        self.assertEqual(self.experiment(1), self.experiment(1))
+        self.assertNotEqual(self.experiment(1), self.experiment(2))
+
+    def test_t_quantile(self):
+        self.assertAlmostEqual(replication.t_quantile(0.975, 10), 2.228, places=2)
+        self.assertAlmostEqual(replication.t_quantile(0.975, 1000), 1.962, places=2)
+
+    def test_stop_when_narrow(self):
+        wide = replication.run_replications(self.experiment, 100.0, processes=2)
+        self.assertEqual(wide["replications"], 3)
+        narrow = replication.run_replications(self.experiment, 0.0, processes=2, max_replications=6)
+        self.assertEqual(narrow["replications"], 6)
+        self.assertEqual(narrow["samples"][:3], wide["samples"])
+        with self.assertRaises(node.SimulatorException):
+            replication.run_replications(self.experiment, 1.0, processes=1, max_replications=0)
+
+    def test_compare_with_itself(self):
+        result = replication.compare(self.experiment, self.experiment, 1.0, processes=1)
+        self.assertEqual(result["samples"], [0.0] * result["replications"])
+
+
+if __name__ == '__main__':
+    unittest.main()